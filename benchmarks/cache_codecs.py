@@ -0,0 +1,77 @@
+""" compare the write time, read time and compression ratio of the @cache codecs on representative arrays
+
+usage: python benchmarks/cache_codecs.py [megabytes]
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rgerum_utils.cache_storage import NpzStorage, _codec_functions
+
+
+def test_arrays(megabytes=64):
+    n = megabytes * 2**20 // 8
+    rng = np.random.default_rng(0)
+    sparse = np.zeros(n)
+    sparse[rng.integers(0, n, n // 100)] = rng.random(n // 100)
+    return {
+        # noise does not compress, this measures the overhead of a codec
+        "random float64": rng.random(n),
+        # e.g. masks or event traces that are mostly zero
+        "sparse float64": sparse,
+        # e.g. label images with few distinct values
+        "labels int64": np.repeat(rng.integers(0, 20, n // 1000), 1000),
+        # e.g. smooth trajectories, the low bits are noise
+        "smooth float64": np.cumsum(rng.normal(size=n)).round(3),
+    }
+
+
+def measure(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def read(path):
+    # decode the stored array, without the conversion of the output to a tuple that @cache applies afterwards
+    with np.load(path, allow_pickle=True) as loaded:
+        if "codec" in loaded:
+            return NpzStorage._decompress(str(loaded["codec"]), loaded["offsets"], loaded["data"])
+        return loaded["output"]
+
+
+def codecs():
+    yield "none", None
+    for codec in ["zlib:1", "zlib:6", "lzma:0", "lz4", "zstd:1", "zstd:3"]:
+        try:
+            _codec_functions(codec)
+        except ImportError:
+            continue
+        yield codec, codec
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "out.npz")
+        for name, array in test_arrays(megabytes).items():
+            print(f"{name} ({array.nbytes / 2**20:.0f}MB)")
+            baseline = os.path.join(folder, "compressed.npz")
+            time_write = measure(lambda: np.savez_compressed(baseline, output=array))
+            time_read = measure(lambda: read(baseline))
+            ratio = array.nbytes / os.path.getsize(baseline)
+            print(f"  {'savez_compressed':16} write: {time_write*1e3:8.1f}ms  read: {time_read*1e3:8.1f}ms  ratio: {ratio:6.1f}")
+            for label, codec in codecs():
+                storage = NpzStorage(codec)
+                time_write = measure(lambda: storage.save(path, array, 1))
+                time_read = measure(lambda: read(path))
+                ratio = array.nbytes / os.path.getsize(path)
+                print(f"  {label:16} write: {time_write*1e3:8.1f}ms  read: {time_read*1e3:8.1f}ms  ratio: {ratio:6.1f}")
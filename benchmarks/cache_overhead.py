@@ -0,0 +1,57 @@
+""" measure the overhead per call of a @cache function on a hit, from the disk and from the memory tier, and of the
+argument binding it does before the cache is checked
+
+usage: python benchmarks/cache_overhead.py [calls]
+"""
+import inspect
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rgerum_utils.cache_decorator import cache
+
+
+def measure(func, calls, repeat=5):
+    # the best time per call in microseconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        times.append(time.perf_counter() - start)
+    return min(times) / calls * 1e6
+
+
+def compute(folder, index, scale=1.0, mode="mean"):
+    return np.arange(3) * scale
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    with tempfile.TemporaryDirectory() as folder:
+        filename = "result_{index}_{mode}.npz"
+        disk = cache(filename)(compute)
+        memory = cache(filename, memory=True)(compute)
+        hashed = cache(filename, memory=True, content_hash=True)(compute)
+        for func in [disk, memory, hashed]:
+            func(folder, 1, mode="max")
+
+        def getcallargs_reference():
+            # what every call did before the signature was bound once at decoration time
+            all_args = inspect.getcallargs(compute, folder, 1, mode="max")
+            return Path(folder) / filename.format(**all_args)
+
+        results = {
+            "plain call": lambda: compute(folder, 1, mode="max"),
+            "getcallargs + format": getcallargs_reference,
+            "cache_path": lambda: disk.cache_path(folder, 1, mode="max"),
+            "hit from memory": lambda: memory(folder, 1, mode="max"),
+            "hit from memory, content_hash": lambda: hashed(folder, 1, mode="max"),
+            "hit from disk": lambda: disk(folder, 1, mode="max"),
+        }
+        for name, func in results.items():
+            print(f"{name:32} {measure(func, calls if 'disk' not in name else calls // 10):8.2f}us per call")
@@ -0,0 +1,51 @@
+""" compare the pruning scandir walker of format_glob with the previous Path.rglob + regex approach on a synthetic deep tree
+
+usage: python benchmarks/format_glob_walker.py [runs] [depth]
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from rgerum_utils.bench import create_tree
+from rgerum_utils.format_glob import format_glob, _pattern_to_regex
+
+
+def rglob_reference(pattern):
+    # the previous implementation: glob for the pattern at any depth and filter with the regex
+    pattern = str(Path(pattern))
+    regexp = re.compile(_pattern_to_regex(pattern))
+    glob_string = re.sub(r"({[^}]*})", "*", pattern)
+    output_base = Path(glob_string)
+    while "*" in str(output_base):
+        output_base = output_base.parent
+    for file in output_base.rglob(str(Path(glob_string).relative_to(output_base))):
+        file = str(file)
+        if regexp.match(file):
+            yield file
+
+
+def measure(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in func())
+        times.append(time.perf_counter() - start)
+    return min(times), count
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with tempfile.TemporaryDirectory() as root:
+        create_tree(root, runs=runs, depth=depth)
+        file_count = sum(len(files) for _, _, files in os.walk(root))
+        print(f"tree with {file_count} files")
+        for pattern in [f"{root}/run-{{run:d}}/result_{{i:d}}.txt", f"{root}/*/result_{{i}}.txt", f"{root}/**/frame_{{i:d}}.txt"]:
+            time_old, count_old = measure(lambda: rglob_reference(pattern))
+            time_new, count_new = measure(lambda: format_glob(pattern))
+            assert count_old == count_new
+            print(f"{pattern[len(root):]:30} {count_new:6} files  rglob: {time_old*1e3:8.2f}ms  scandir: {time_new*1e3:8.2f}ms  speedup: {time_old/time_new:5.1f}x")
@@ -1,4 +1,47 @@
-from .cache_decorator import cache
-from .format_glob import format_glob, format_glob_pd
-from .timeit import TimeIt
-from .plot.plot_group import PlotGroup
+import importlib
+import sys
+import types
+
+# the public names and the submodules that define them, a submodule (and its dependencies like pandas or matplotlib)
+# is only imported when one of its names is used for the first time
+_lazy_imports = {
+    "cache": ".cache_decorator",
+    "MemoryCache": ".cache_decorator",
+    "CacheRegistry": ".cache_registry",
+    "CacheStats": ".cache_decorator",
+    "ChunkedResult": ".cache_storage",
+    "format_glob": ".format_glob",
+    "format_glob_pd": ".format_glob",
+    "format_glob_write": ".format_glob",
+    "format_glob_multi": ".format_glob",
+    "DirectoryIndex": ".format_glob",
+    "FormatPattern": ".format_glob",
+    "TimeIt": ".timeit",
+    "Profiler": ".timeit",
+    "PlotGroup": ".plot.plot_group",
+}
+
+__all__ = list(_lazy_imports)
+
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+class _LazyPackage(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing a submodule like format_glob or cache would otherwise replace the function of the same name
+        if isinstance(value, types.ModuleType) and name in _lazy_imports:
+            value = getattr(importlib.import_module(_lazy_imports[name], self.__name__), name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyPackage
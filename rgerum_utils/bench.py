@@ -0,0 +1,315 @@
+""" run benchmarks with warmup and calibrated repetitions, report robust statistics and compare runs across commits
+
+    python -m rgerum_utils.bench [--filter NAME] [--save results.json] [--compare baseline.json] [--threshold 0.1]
+
+runs the benchmark suite of the package's hot paths. In python:
+
+    result = run(func, name="my function")
+    save({result.name: result}, "results.json")
+    print(format_comparison(compare(load("baseline.json"), load("results.json"))))
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .timeit import Profiler
+
+
+def _quantiles(values):
+    # the first quartile, median and third quartile
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    q1, median, q3 = statistics.quantiles(values, n=4, method="inclusive")
+    return q1, median, q3
+
+
+class BenchmarkResult:
+    """ the times of one benchmark and their robust statistics
+
+    The samples outside of the Tukey fences (more than 1.5 IQR below the first or above the third quartile) are counted
+    as outliers and not used for the mean, min and max.
+    :parameter
+    name: the name of the benchmark
+    samples: the time per call in seconds of every repetition
+    number: the calls per repetition
+    blocks: the stats of the TimeIt blocks of a profiled run
+    """
+    def __init__(self, name, samples, number=1, blocks=None):
+        self.name = name
+        self.samples = list(samples)
+        self.number = number
+        self.blocks = blocks
+        self.q1, self.median, self.q3 = _quantiles(sorted(self.samples))
+        self.iqr = self.q3 - self.q1
+        low, high = self.q1 - 1.5 * self.iqr, self.q3 + 1.5 * self.iqr
+        kept = [sample for sample in self.samples if low <= sample <= high] or self.samples
+        self.outliers = len(self.samples) - len(kept)
+        self.mean = statistics.fmean(kept)
+        self.min = min(kept)
+        self.max = max(kept)
+
+    def as_dict(self):
+        return dict(name=self.name, median=self.median, iqr=self.iqr, q1=self.q1, q3=self.q3, mean=self.mean,
+                    min=self.min, max=self.max, outliers=self.outliers, rounds=len(self.samples), number=self.number,
+                    samples=self.samples, blocks=self.blocks)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["samples"], data.get("number", 1), data.get("blocks"))
+
+    def __repr__(self):
+        return (f"BenchmarkResult({self.name!r}, median={format_time(self.median)}, iqr={format_time(self.iqr)}, "
+                f"rounds={len(self.samples)})")
+
+
+def format_time(seconds):
+    for unit, factor in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= factor:
+            return f"{seconds / factor:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
+
+
+def run(func, name=None, setup=None, number=None, repeat=20, warmup=0.1, min_sample_time=0.01, max_time=10.0,
+        profile=False):
+    """ benchmark a function that is called without arguments
+    :parameter
+    func: the function to measure
+    name: the name of the benchmark, defaults to the name of the function
+    setup: a function called before every repetition, its time is not measured, e.g. to remove a cache file
+    number: the calls per repetition, by default calibrated so that a repetition takes at least min_sample_time
+    repeat: the number of repetitions
+    warmup: the seconds to call the function before measuring, e.g. to fill caches and import modules
+    min_sample_time: the minimal time of a repetition in seconds for the calibration
+    max_time: stop after this many seconds even if not all repetitions are done (at least 3 are done)
+    profile: weather to collect the TimeIt blocks inside the function with a Profiler and add their stats
+    :return
+    a BenchmarkResult with the time per call
+    """
+    name = name or getattr(func, "__qualname__", repr(func))
+
+    def measure(count):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        for _ in range(count):
+            func()
+        return (time.perf_counter_ns() - start) * 1e-9
+
+    # warmup
+    start = time.perf_counter()
+    while True:
+        measure(1)
+        if time.perf_counter() - start >= warmup:
+            break
+
+    # calibrate the calls per repetition, multiplying by ten until a repetition is long enough
+    if number is None:
+        number = 1
+        while True:
+            elapsed = measure(number)
+            if elapsed >= min_sample_time or setup is not None:
+                break
+            number = number * 10 if elapsed < min_sample_time / 10 else int(number * min_sample_time / elapsed) + 1
+
+    profiler = Profiler() if profile else None
+    if profiler is not None:
+        profiler.start()
+    try:
+        samples = []
+        start = time.perf_counter()
+        for i in range(repeat):
+            samples.append(measure(number) / number)
+            if i >= 2 and time.perf_counter() - start > max_time:
+                break
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    return BenchmarkResult(name, samples, number, profiler.stats() if profiler is not None else None)
+
+
+def run_suite(benchmarks, filter=None, verbose=True, **kwargs):
+    """ run a dict of benchmarks, the values are functions or dicts of the arguments of run, returns a dict of the
+    BenchmarkResults, the other keyword arguments are defaults for run """
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if filter is not None and filter not in name:
+            continue
+        options = dict(kwargs, **benchmark) if isinstance(benchmark, dict) else dict(kwargs, func=benchmark)
+        results[name] = run(name=name, **options)
+        if verbose:
+            print(format_results({name: results[name]}, header=len(results) == 1), flush=True)
+    return results
+
+
+def format_results(results, header=True):
+    """ the results as a text table """
+    lines = []
+    if header:
+        lines.append(f"{'benchmark':40} {'median':>9} {'iqr':>9} {'min':>9} {'max':>9} {'outliers':>8} {'rounds':>6}")
+    for name, result in results.items():
+        lines.append(f"{name:40} {format_time(result.median):>9} {format_time(result.iqr):>9} "
+                     f"{format_time(result.min):>9} {format_time(result.max):>9} {result.outliers:>8} "
+                     f"{len(result.samples):>6}")
+    return "\n".join(lines)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(results, filename):
+    """ save the results as json, with the commit, python version and machine to compare them later """
+    data = dict(
+        meta=dict(commit=_git_commit(), date=datetime.datetime.now().isoformat(timespec="seconds"),
+                  python=platform.python_version(), machine=platform.machine(), node=platform.node()),
+        results={name: result.as_dict() for name, result in results.items()},
+    )
+    with open(filename, "w") as fp:
+        json.dump(data, fp, indent=1)
+
+
+def load(filename):
+    """ load the results saved with save """
+    with open(filename) as fp:
+        data = json.load(fp)
+    return {name: BenchmarkResult.from_dict(result) for name, result in data["results"].items()}
+
+
+def compare(baseline, current, threshold=0.1):
+    """ compare the medians of two result dicts, returns a list of dicts with the name, the medians, their ratio and
+    a flag "regression" if the current median is more than threshold slower, "improvement" if it is more than
+    threshold faster, else "" """
+    rows = []
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        ratio = result.median / baseline[name].median
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "regression"
+        elif ratio < 1 / (1 + threshold):
+            flag = "improvement"
+        rows.append(dict(name=name, baseline=baseline[name].median, current=result.median, ratio=ratio, flag=flag))
+    return rows
+
+
+def format_comparison(rows):
+    """ the comparison as a text table """
+    lines = [f"{'benchmark':40} {'baseline':>9} {'current':>9} {'ratio':>7}"]
+    for row in rows:
+        lines.append(f"{row['name']:40} {format_time(row['baseline']):>9} {format_time(row['current']):>9} "
+                     f"{row['ratio']:>7.2f} {row['flag']}")
+    return "\n".join(lines)
+
+
+def create_tree(root, runs=20, depth=3, files=10):
+    """ create a synthetic folder tree in root: every run folder has a few result files and a deep tree of raw data
+    that can never match the patterns of the benchmarks """
+    for r in range(runs):
+        run_folder = Path(root) / f"run-{r}"
+        run_folder.mkdir(parents=True)
+        for i in range(files):
+            (run_folder / f"result_{i}.txt").touch()
+        folder = run_folder / "raw"
+        for d in range(depth):
+            for s in range(3):
+                sub = folder / f"part{s}"
+                sub.mkdir(parents=True)
+                for i in range(files):
+                    (sub / f"frame_{i}.txt").touch()
+            folder = folder / "part0"
+
+
+def package_suite(root):
+    """ the benchmarks of the hot paths of the package, using a synthetic folder tree created in root """
+    import numpy as np
+    from .cache_decorator import cache
+    from .format_glob import format_glob, format_glob_pd
+
+    create_tree(root)
+    benchmarks = {
+        "format_glob placeholders": lambda: list(format_glob(f"{root}/run-{{run:d}}/result_{{i:d}}.txt")),
+        "format_glob **": lambda: list(format_glob(f"{root}/**/frame_{{i:d}}.txt")),
+        "format_glob_pd": lambda: format_glob_pd(f"{root}/run-{{run:d}}/**/frame_{{i:d}}.txt"),
+    }
+
+    def compute(folder, index):
+        return np.arange(1000) * index
+
+    cache_folder = Path(root) / "cache"
+    cache_folder.mkdir()
+    hit = cache("result_{index}.npz")(compute)
+    memory_hit = cache("result_{index}.npz", memory=True)(compute)
+    miss = cache("miss_{index}.npz")(compute)
+    hit(cache_folder, 1)
+
+    def remove_miss():
+        (cache_folder / "miss_1.npz").unlink(missing_ok=True)
+
+    benchmarks.update({
+        "cache hit": lambda: hit(cache_folder, 1),
+        "cache hit from memory": lambda: memory_hit(cache_folder, 1),
+        "cache miss": dict(func=lambda: miss(cache_folder, 1), setup=remove_miss, number=1),
+    })
+
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return benchmarks
+    from .plot.subplots import SubPlots
+
+    def grow_grid():
+        # add the axes one by one, every new row or column changes the shape of the grid
+        subplots = SubPlots()
+        for row in range(4):
+            for col in range(4):
+                subplots.select_ax(row, col)
+        plt.close(subplots.fig)
+
+    benchmarks["SubPlots.change_shape 4x4"] = grow_grid
+    return benchmarks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m rgerum_utils.bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", help="only run the benchmarks with this text in their name")
+    parser.add_argument("--save", help="save the results to this json file")
+    parser.add_argument("--compare", help="compare the results to a json file saved before")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="the relative slowdown of the median that is flagged as a regression (default 0.1)")
+    parser.add_argument("--repeat", type=int, default=20, help="the repetitions of every benchmark")
+    args = parser.parse_args(argv)
+
+    try:
+        # the figures of the plot benchmarks are not shown
+        import matplotlib
+        matplotlib.use("Agg")
+    except ImportError:
+        pass
+    with tempfile.TemporaryDirectory() as root:
+        results = run_suite(package_suite(root), filter=args.filter, repeat=args.repeat)
+    if args.save:
+        save(results, args.save)
+    if args.compare:
+        rows = compare(load(args.compare), results, args.threshold)
+        print()
+        print(format_comparison(rows))
+        if any(row["flag"] == "regression" for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from rgerum_utils.bench import BenchmarkResult, run, run_suite, save, load, compare
+from rgerum_utils.timeit import TimeIt
+
+
+def test_statistics():
+    result = BenchmarkResult("test", [1.0, 1.1, 0.9, 1.0, 1.05, 0.95, 10.0])
+    assert result.median == 1.0
+    # the outlier is rejected
+    assert result.outliers == 1 and result.max == 1.1
+    assert abs(result.mean - 1.0) < 1e-9
+    assert BenchmarkResult.from_dict(result.as_dict()).as_dict() == result.as_dict()
+
+
+def test_run():
+    calls = 0
+    setups = 0
+
+    def func():
+        nonlocal calls
+        calls += 1
+        with TimeIt("block"):
+            time.sleep(0.0001)
+
+    def setup():
+        nonlocal setups
+        setups += 1
+
+    result = run(func, repeat=5, warmup=0, min_sample_time=0.005, profile=True)
+    # the calls per repetition are calibrated
+    assert result.number > 1 and len(result.samples) == 5
+    assert 0.0001 < result.median < 0.01
+    assert result.blocks[0]["name"] == "block" and result.blocks[0]["count"] == 5 * result.number
+
+    # with a setup every call is one repetition
+    calls = 0
+    result = run(func, setup=setup, number=1, repeat=3, warmup=0)
+    assert calls == setups == 4 and result.number == 1
+
+
+def test_compare(tmp_path):
+    results = run_suite(dict(fast=lambda: None, slow=dict(func=lambda: time.sleep(0.001), number=1)), repeat=3,
+                        warmup=0, min_sample_time=0.001, verbose=False)
+    save(results, tmp_path / "baseline.json")
+    baseline = load(tmp_path / "baseline.json")
+    assert baseline["slow"].samples == results["slow"].samples
+
+    current = dict(fast=BenchmarkResult("fast", [baseline["fast"].median / 2]),
+                   slow=BenchmarkResult("slow", [baseline["slow"].median * 1.5]))
+    rows = {row["name"]: row for row in compare(baseline, current, threshold=0.2)}
+    assert rows["fast"]["flag"] == "improvement"
+    assert rows["slow"]["flag"] == "regression" and abs(rows["slow"]["ratio"] - 1.5) < 1e-9
+    assert compare(baseline, current, threshold=1)[1]["flag"] == ""
+
+
+def test_package_suite(tmp_path):
+    # run in a fresh interpreter from the repository root, where the package does not shadow the standard library
+    # timeit module that matplotlib imports
+    code = ("import sys; from rgerum_utils.bench import package_suite, run_suite; "
+            "benchmarks = package_suite(sys.argv[1]); "
+            "assert 'cache miss' in benchmarks and 'format_glob_pd' in benchmarks; "
+            "results = run_suite(benchmarks, repeat=1, warmup=0, min_sample_time=0, verbose=False); "
+            "assert set(results) == set(benchmarks)")
+    subprocess.run([sys.executable, "-c", code, str(tmp_path)], cwd=Path(__file__).parent.parent, check=True)
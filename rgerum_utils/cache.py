@@ -0,0 +1,106 @@
+""" manage the cache entries recorded in a CacheRegistry
+
+    python -m rgerum_utils.cache list [--function NAME] [--version V]
+    python -m rgerum_utils.cache measure FOLDER [--pattern "*.npz" ...]
+    python -m rgerum_utils.cache prune [--max-bytes 100G] [--max-age 30d] [--policy lru|age] [--dry-run]
+    python -m rgerum_utils.cache invalidate [--function NAME] [--version V] [--stale] [--dry-run]
+"""
+import argparse
+import datetime
+import sys
+
+from .cache_registry import CacheRegistry
+
+_size_units = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+_age_units = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+
+
+def parse_size(text):
+    """ a size like "500M" or "2G" in bytes """
+    text = text.strip().upper().removesuffix("B")
+    if text[-1:] in _size_units:
+        return int(float(text[:-1]) * _size_units[text[-1]])
+    return int(text)
+
+
+def parse_age(text):
+    """ an age like "12h" or "30d" in seconds """
+    text = text.strip().lower()
+    if text[-1:] in _age_units:
+        return float(text[:-1]) * _age_units[text[-1]]
+    return float(text)
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def parse_version(text):
+    # versions are usually integers
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def print_entries(entries, file=sys.stdout):
+    for path, function, version, size, created, accessed in entries:
+        accessed = datetime.datetime.fromtimestamp(accessed).strftime("%Y-%m-%d %H:%M")
+        print(f"{format_size(size):>8}  {accessed}  {str(version):>7}  {function or '-'}  {path}", file=file)
+    print(f"{len(entries)} entries, {format_size(sum(entry[3] for entry in entries))}", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m rgerum_utils.cache", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--registry", help="the registry file, defaults to the one used by @cache(..., registry=True)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("list", help="list the registered entries")
+    command.add_argument("--function", help="only the entries of this function")
+    command.add_argument("--version", type=parse_version, help="only the entries of this version")
+
+    command = commands.add_parser("measure", help="register the cache files in a folder and update their sizes")
+    command.add_argument("folder")
+    command.add_argument("--pattern", action="append", help="the filename pattern of the cache files (default *.npz)")
+
+    command = commands.add_parser("prune", help="evict the oldest entries")
+    command.add_argument("--max-bytes", type=parse_size, help="evict until the total size is below, e.g. 100G")
+    command.add_argument("--max-age", type=parse_age, help="evict entries older than this, e.g. 30d")
+    command.add_argument("--policy", choices=["lru", "age"], default="lru",
+                         help="evict the least recently accessed (lru) or the oldest created (age) entries first")
+    command.add_argument("--dry-run", action="store_true", help="only list the entries that would be removed")
+
+    command = commands.add_parser("invalidate", help="remove the entries of a function or version")
+    command.add_argument("--function", help="only the entries of this function")
+    command.add_argument("--version", type=parse_version, help="only the entries of this version")
+    command.add_argument("--stale", action="store_true",
+                         help="only the entries with a lower version than the newest one of their function")
+    command.add_argument("--dry-run", action="store_true", help="only list the entries that would be removed")
+
+    args = parser.parse_args(argv)
+    registry = CacheRegistry(args.registry)
+    try:
+        if args.command == "list":
+            print_entries(registry.entries(args.function, args.version))
+        elif args.command == "measure":
+            count, size = registry.scan(args.folder, args.pattern or ["*.npz"])
+            print(f"{count} entries, {format_size(size)} in {args.folder}")
+        elif args.command == "prune":
+            if args.max_bytes is None and args.max_age is None:
+                parser.error("prune needs --max-bytes or --max-age")
+            print_entries(registry.prune(args.max_bytes, args.max_age, args.policy, dry_run=args.dry_run))
+        elif args.command == "invalidate":
+            if args.function is None and args.version is None and not args.stale:
+                parser.error("invalidate needs --function, --version or --stale")
+            print_entries(registry.invalidate(args.function, args.version, args.stale, dry_run=args.dry_run))
+    finally:
+        registry.close()
+
+
+if __name__ == "__main__":
+    main()
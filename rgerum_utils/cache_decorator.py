@@ -1,36 +1,723 @@
 import numpy as np
 from pathlib import Path
+import functools
+import glob
+import hashlib
 import inspect
+import itertools
+import json
+import os
+import pickle
+import socket
+import string
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
+from rgerum_utils.cache_registry import CacheRegistry, default_registry, _entry_size
+from rgerum_utils.cache_storage import (NpzStorage, NpyStorage, ColumnarStorage, ChunkedResult, ChunkedStorage, storages,
+                                        _temp_path)
 
-def cache(filename, version=1, force_write=False):
+
+def _hash_value(h, value):
+    # feed a canonical byte representation of the value into the hash object
+    if isinstance(value, np.ndarray):
+        h.update(b"ndarray" + str(value.dtype).encode() + str(value.shape).encode())
+        if value.dtype.hasobject:
+            h.update(pickle.dumps(value))
+        else:
+            h.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, (list, tuple)):
+        h.update(type(value).__name__.encode() + str(len(value)).encode())
+        for item in value:
+            _hash_value(h, item)
+    elif isinstance(value, dict):
+        h.update(b"dict" + str(len(value)).encode())
+        for key in sorted(value, key=repr):
+            _hash_value(h, key)
+            _hash_value(h, value[key])
+    elif isinstance(value, (set, frozenset)):
+        # the iteration order of a set depends on the hash seed of the process
+        h.update(type(value).__name__.encode() + str(len(value)).encode())
+        for item in sorted(value, key=repr):
+            _hash_value(h, item)
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, Path)):
+        h.update(type(value).__name__.encode() + repr(value).encode())
+    else:
+        h.update(pickle.dumps(value))
+
+
+def _hash_code(h, code):
+    # the bytecode and constants of a code object, including nested functions, but not the line numbers
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _hash_code(h, const)
+        else:
+            h.update(repr(const).encode())
+
+
+def _function_hash(func):
+    """ a hash of the code of a function, from its source if available, otherwise from its bytecode """
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        h.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+        _hash_code(h, func.__code__)
+    return h.hexdigest()
+
+
+def _hash_inputs(h, folder, inputs, input_hash):
+    # the modification times and sizes (or the content) of the files matching the input patterns in the folder
+    for pattern in inputs:
+        for file in sorted(glob.glob(str(Path(folder) / pattern), recursive=True)):
+            h.update(file.encode())
+            if input_hash == "content":
+                with open(file, "rb") as fp:
+                    for block in iter(lambda: fp.read(1 << 20), b""):
+                        h.update(block)
+            else:
+                stat = os.stat(file)
+                h.update(f"{stat.st_mtime_ns} {stat.st_size}".encode())
+
+
+def _output_size(output):
+    # approximate the memory used by a result
+    if isinstance(output, np.memmap):
+        # memory-mapped arrays are only read on access and do not count
+        return sys.getsizeof(output)
+    if isinstance(output, np.ndarray):
+        if output.dtype.hasobject:
+            return output.nbytes + sum(_output_size(item) for item in output.flat)
+        return output.nbytes
+    if isinstance(output, (list, tuple)):
+        return sys.getsizeof(output) + sum(_output_size(item) for item in output)
+    if isinstance(output, dict):
+        return sys.getsizeof(output) + sum(_output_size(key) + _output_size(value) for key, value in output.items())
+    if hasattr(output, "memory_usage") and hasattr(output, "columns"):
+        return int(output.memory_usage(deep=True).sum())
+    return sys.getsizeof(output)
+
+
+class MemoryCache:
+    """ an in-process LRU cache that keeps loaded results of @cache functions in memory
+
+    An entry is only used if the modification time of the cache file and the version are unchanged. The results are
+    returned as the same objects for every hit, so they should not be modified in place.
+    :parameter
+    max_entries: the maximal number of results to keep
+    max_bytes: the maximal approximate size of all kept results, larger results are not kept at all
+    """
+    def __init__(self, max_entries=128, max_bytes=2**30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, mtime, version):
+        """ return (True, output) if the key is cached with the given modification time and version, else (False, None) """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime and entry[1] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, mtime, version, output):
+        size = _output_size(output)
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (mtime, version, output, size)
+            self.bytes += size
+            # evict the least recently used entries
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """ the number of hits, misses and evictions and the current number of entries and bytes """
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self.entries),
+                        bytes=self.bytes)
+
+
+# the memory cache used by @cache(..., memory=True)
+memory_cache = MemoryCache()
+
+
+class CacheStats:
+    """ the counters and times of a @cache function, available as func.stats and in function_stats
+
+    hits: the calls that returned a cached result, memory_hits of them came from the memory tier
+    misses: the calls that computed the result, version_mismatches of them replaced an entry of another version
+    bytes_read, bytes_written: the size of the cache entries that were loaded from disk and written
+    load_time, compute_time, save_time: the seconds spent loading cached results, computing and saving results
+
+    The counters are not locked, so they can miss a few events if the function is called from many threads at once.
+    """
+    counters = ("hits", "memory_hits", "misses", "version_mismatches", "bytes_read", "bytes_written", "load_time",
+                "compute_time", "save_time")
+
+    def __init__(self, function):
+        self.function = function
+        self.reset()
+
+    def reset(self):
+        for name in self.counters:
+            setattr(self, name, 0)
+
+    def add(self, counters):
+        """ add the counters of a dict, e.g. of as_dict() from another process """
+        for name in self.counters:
+            setattr(self, name, getattr(self, name) + counters.get(name, 0))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.counters}
+
+    @property
+    def time_saved(self):
+        """ the estimated seconds saved by the hits: the mean compute time per hit minus the time to load them """
+        if self.misses == 0:
+            return 0.0
+        return self.hits * (self.compute_time + self.save_time) / self.misses - self.load_time
+
+    def __repr__(self):
+        return (f"CacheStats({self.function}, hits={self.hits}, misses={self.misses}, "
+                f"version_mismatches={self.version_mismatches}, load_time={self.load_time:.3f}s, "
+                f"compute_time={self.compute_time:.3f}s)")
+
+
+# the stats of all @cache functions by their module and qualified name
+function_stats = {}
+
+
+class FileLock:
+    """ a lock file to let only one process (also on other hosts with a shared file system) compute a cache entry
+
+    The lock file contains the host and process id of its owner and its modification time is refreshed regularly while
+    the lock is held. A lock is stale, and is removed by the next process waiting for it, if its owner process on the
+    same host does not exist anymore or if it was not refreshed for stale_after seconds.
+    :parameter
+    path: the lock file
+    stale_after: the time in seconds after which a lock that is not refreshed is considered stale
+    poll_interval: the time in seconds between two checks of a lock held by another process
+    """
+    hostname = socket.gethostname()
+
+    def __init__(self, path, stale_after=60, poll_interval=0.1):
+        self.path = Path(path)
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.token = None
+        self._stop = None
+
+    def acquire(self, timeout=None):
+        """ wait until the lock is acquired, returns False if timeout seconds passed without acquiring it """
+        start = time.time()
+        token = f"{self.hostname}:{os.getpid()}:{uuid.uuid4().hex}"
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                self._remove_if_stale()
+                if timeout is not None and time.time() - start > timeout:
+                    return False
+                time.sleep(self.poll_interval)
+                continue
+            with os.fdopen(fd, "w") as fp:
+                json.dump(dict(host=self.hostname, pid=os.getpid(), token=token), fp)
+            self.token = token
+            # keep the lock fresh while it is held
+            self._stop = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(self._stop,), daemon=True).start()
+            return True
+
+    def release(self):
+        if self.token is None:
+            return
+        self._stop.set()
+        # only remove the lock if it is still ours
+        if self._read().get("token") == self.token:
+            self.path.unlink(missing_ok=True)
+        self.token = None
+
+    def _heartbeat(self, stop):
+        while not stop.wait(self.stale_after / 4):
+            try:
+                os.utime(self.path)
+            except OSError:  # pragma: no cover
+                pass
+
+    def _read(self, path=None):
+        try:
+            with open(path or self.path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _remove_if_stale(self):
+        try:
+            lock_stat = os.stat(self.path)
+        except OSError:
+            return
+        info = self._read()
+        stale = time.time() - lock_stat.st_mtime > self.stale_after
+        # a lock of a process on this host that does not exist anymore is stale right away
+        if not stale and info.get("host") == self.hostname and "pid" in info and os.name == "posix":
+            try:
+                os.kill(info["pid"], 0)
+            except ProcessLookupError:
+                stale = True
+            except OSError:
+                pass
+        if not stale:
+            return
+        # move the lock away before deleting it and put it back if another process replaced it in the meantime
+        moved = _temp_path(self.path)
+        try:
+            os.replace(self.path, moved)
+        except OSError:
+            return
+        if not os.path.samestat(os.stat(moved), lock_stat) or self._read(moved).get("token") != info.get("token"):
+            try:
+                os.link(moved, self.path)
+            except OSError:
+                # a third process created a lock in the meantime, the moved lock of the new owner is kept, as deleting
+                # it could let its owner and a later process compute at the same time
+                return
+        os.unlink(moved)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def _compute_entry(func, folder, args, kwargs):
+    # runs in the workers of func.map, the result is only written to the cache and loaded again by the caller, the
+    # change of the stats is returned to be added to the stats of the caller if the worker is another process
+    before = func.stats.as_dict()
+    func(folder, *args, **kwargs)
+    after = func.stats.as_dict()
+    return os.getpid(), {name: after[name] - before[name] for name in after}
+
+
+def _argument_binder(func):
+    """ return a function that maps the arguments of a call of func to a dict of all parameters including the defaults,
+    like inspect.getcallargs, but with the signature only inspected once """
+    signature = inspect.signature(func)
+    parameters = list(signature.parameters.values())
+    names = [parameter.name for parameter in parameters]
+    known = set(names)
+    defaults = {parameter.name: parameter.default for parameter in parameters if parameter.default is not parameter.empty}
+    # the fast path only handles parameters without *args, **kwargs and keyword-only parameters
+    simple = all(parameter.kind == parameter.POSITIONAL_OR_KEYWORD for parameter in parameters)
+
+    def bind_slow(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+
+    if not simple:
+        return bind_slow
+
+    def bind(*args, **kwargs):
+        if len(args) > len(names):
+            return bind_slow(*args, **kwargs)
+        arguments = dict(zip(names, args))
+        if kwargs:
+            if not kwargs.keys() <= known or not kwargs.keys().isdisjoint(arguments):
+                return bind_slow(*args, **kwargs)
+            arguments.update(kwargs)
+        if len(arguments) < len(names):
+            for name, value in defaults.items():
+                arguments.setdefault(name, value)
+        # missing arguments raise the TypeError of signature.bind
+        if len(arguments) != len(names):
+            return bind_slow(*args, **kwargs)
+        return arguments
+
+    return bind
+
+
+def _wrap_generator(func, cache_path, acquire_lock, count_hit, count_miss, version, force_write, resume_argument):
+    """ the @cache wrapper of a generator function, the chunks are written as they are yielded and an interrupted run is
+    continued from its last complete chunk """
+    storage = ChunkedStorage()
+
+    @functools.wraps(func)
+    def wrapped_func(folder, *args, **kwargs):
+        output_path = cache_path(folder, *args, **kwargs)
+        start = time.perf_counter()
+        if not force_write:
+            found, output = storage.load(output_path, version)
+            if found:
+                count_hit(output_path, start, 0)
+                return output
+
+        file_lock = acquire_lock(output_path)
+        try:
+            state = None if force_write else storage.state(output_path, version)
+            # another process finished the run while we waited for the lock
+            if state is not None and state[1]:
+                count_hit(output_path, start, 0)
+                return storage.load(output_path, version)[1]
+            mismatch = state is None and not force_write
+            count = 0 if state is None else state[0]
+            if count == 0:
+                storage.start(output_path, version)
+
+            start = time.perf_counter()
+            if count and resume_argument is not None:
+                chunks = func(folder, *args, **{**kwargs, resume_argument: count})
+            else:
+                # without a resume argument the complete chunks are computed again, but not written again
+                chunks = itertools.islice(func(folder, *args, **kwargs), count, None)
+            nbytes = 0
+            write_time = 0
+            for index, chunk in enumerate(chunks, start=count):
+                write_start = time.perf_counter()
+                nbytes += storage.append(output_path, index, chunk, version)
+                write_time += time.perf_counter() - write_start
+                count = index + 1
+            storage.finish(output_path, version, count)
+            count_miss(output_path, time.perf_counter() - start - write_time, write_time, nbytes, mismatch)
+        finally:
+            if file_lock is not None:
+                file_lock.release()
+        return storage.load(output_path, version)[1]
+
+    wrapped_func.cache_path = cache_path
+    return wrapped_func
+
+
+def _wrap_async(func, cache_path, load_cached, acquire_lock, save_entry, stats, force_write, hash_inputs):
+    """ the @cache wrapper of a coroutine function, the file access runs in the default executor of the event loop and
+    concurrent calls for the same entry share one load or computation """
+    import asyncio
+    # the running loads or computations by event loop and entry
+    in_flight = {}
+
+    async def load_or_compute(loop, output_path, folder, args, kwargs):
+        if not force_write:
+            found, output = await loop.run_in_executor(None, load_cached, output_path)
+            if found:
+                return output
+        file_lock = await loop.run_in_executor(None, acquire_lock, output_path)
+        try:
+            if file_lock is not None and not force_write:
+                found, output = await loop.run_in_executor(None, load_cached, output_path)
+                if found:
+                    return output
+            start = time.perf_counter()
+            output = await func(folder, *args, **kwargs)
+            await loop.run_in_executor(None, save_entry, output_path, output, time.perf_counter() - start)
+        finally:
+            if file_lock is not None:
+                await loop.run_in_executor(None, file_lock.release)
+        return output
+
+    @functools.wraps(func)
+    async def wrapped_func(folder, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if hash_inputs:
+            # hashing the input files reads from disk
+            output_path = await loop.run_in_executor(None, functools.partial(cache_path, folder, *args, **kwargs))
+        else:
+            output_path = cache_path(folder, *args, **kwargs)
+        key = (loop, os.path.abspath(output_path))
+        task = in_flight.get(key)
+        if task is None:
+            task = loop.create_task(load_or_compute(loop, output_path, folder, args, kwargs))
+            in_flight[key] = task
+            task.add_done_callback(lambda _: in_flight.pop(key, None))
+        # a cancelled caller does not cancel the computation the other callers wait for
+        return await asyncio.shield(task)
+
+    wrapped_func.cache_path = cache_path
+    wrapped_func.stats = stats
+    return wrapped_func
+
+
+def cache(filename, version=1, force_write=False, content_hash=False, inputs=None, input_hash="mtime", memory=False,
+          storage="npz", lock=True, registry=None, codec=None, callback=None, resume_argument=None):
     """ a decorator to cache the output of a function that takes a folder as its first argument
     :parameter
-    filename: the filename of the cache
+    filename: the filename of the cache (the folder name for storage="npy")
     version: the version number of the function, if increased overwrite earlier cache versions
     force_write: weather to always write to the cache, disable reading the cache (for testing the function)
+    content_hash: weather to add a hash of all arguments and of the function code to the filename, so that a change of
+                  any argument or of the function automatically uses a new cache file
+    inputs: glob patterns (relative to the folder) of input files to add to the hash, implies content_hash
+    input_hash: weather to hash the "mtime" and size of the input files or their "content"
+    memory: weather to keep loaded results in the in-process memory_cache, or the MemoryCache to use
+    storage: how to store the output, "npz" (default) for a single .npz file, "npy" for memory-mapped .npy files,
+             "columnar" for DataFrames as parquet files, or a storage object with the methods mtime, load and save
+    lock: weather to use a lock file so that only one process computes a missing entry while the others wait for it
+    registry: a CacheRegistry to record the written entries and their accesses in, True for the default registry
+    codec: the compression of the npz storage, e.g. "zlib", "lz4" or "zstd:3", see NpzStorage, the cache files are
+           read with the codec they were written with
+    callback: called as callback(function, event, path, seconds, nbytes) for every "hit", "memory_hit", "miss" and
+              "version_mismatch", e.g. to forward the metrics to a logger, the counters are in func.stats
+    resume_argument: for a generator function, the name of its parameter that gets the index of the first chunk to
+                     compute when an interrupted run is continued, without it the complete chunks are computed again
+                     but not written again
+
+    An async def function is awaited as usual, the cache file access then runs in an executor and concurrent calls for
+    the same entry share one load or computation.
+    A generator function is cached chunk by chunk in a folder, every yielded chunk is written right away, an interrupted
+    run continues from its last complete chunk and the call returns a lazy ChunkedResult of all chunks.
     """
+    if inputs is not None:
+        content_hash = True
+    if memory is True:
+        memory = memory_cache
+    elif memory is False:
+        memory = None
+    if codec is not None:
+        if storage != "npz":
+            raise ValueError("a codec can only be used with storage=\"npz\"")
+        storage = NpzStorage(codec)
+    if isinstance(storage, str):
+        storage = storages[storage]
+    if registry is True:
+        registry = default_registry()
+
     def wrap(func):
-        def wrapped_func(folder, *args, **kwargs):
+        code_hash = _function_hash(func) if content_hash else None
+        folder_argument = next(iter(inspect.signature(func).parameters))
+        function_name = f"{func.__module__}.{func.__qualname__}"
+        stats = function_stats[function_name] = CacheStats(function_name)
+
+        bind_arguments = _argument_binder(func)
+        # a filename without fields does not need to be formatted
+        format_filename = filename.format_map if any(field is not None for _, field, _, _ in
+                                                     string.Formatter().parse(filename)) else None
+
+        def cache_path(folder, *args, **kwargs):
             # get args
-            all_args = inspect.getcallargs(func, folder, *args, **kwargs)
+            all_args = bind_arguments(folder, *args, **kwargs)
             # join the path and add arguments into filename
-            output_path = Path(folder) / filename.format(**all_args)
+            output_path = Path(folder, format_filename(all_args) if format_filename is not None else filename)
+            if content_hash:
+                # the key of the content hash: the code of the function, the arguments and the input files
+                h = hashlib.blake2b(digest_size=8)
+                h.update(code_hash.encode())
+                _hash_value(h, {key: value for key, value in all_args.items() if key != folder_argument})
+                if inputs is not None:
+                    _hash_inputs(h, folder, inputs, input_hash)
+                output_path = output_path.with_name(f"{output_path.stem}.{h.hexdigest()}{output_path.suffix}")
+            return output_path
+
+        def count_hit(output_path, start, nbytes):
+            seconds = time.perf_counter() - start
+            stats.hits += 1
+            stats.memory_hits += nbytes is None
+            stats.load_time += seconds
+            stats.bytes_read += nbytes or 0
+            if registry is not None:
+                registry.touch(output_path)
+            if callback is not None:
+                callback(function_name, "hit" if nbytes is not None else "memory_hit", output_path, seconds, nbytes or 0)
+
+        def load_cached(output_path, count=True):
+            # return (True, output) if there is a cache entry with the current version, else (False, None)
+            start = time.perf_counter()
+            mtime = storage.mtime(output_path)
             # if the output path exists
-            if output_path.exists() and not force_write:
-                # load from cache
-                loaded = np.load(output_path, allow_pickle=True)
-                # only return it if the version is the current one
-                if loaded.get("version", None) == version:
-                    try:
-                        return tuple(loaded["output"])
-                    except TypeError:
-                        return loaded["output"][()]
-            # call the function
-            output = func(folder, *args, **kwargs)
-            # save the result
-            np.savez(output_path, output=output, version=version)
+            if mtime is None:
+                return False, None
+            # take it from memory if the file did not change since it was loaded
+            if memory is not None:
+                key = os.path.abspath(output_path)
+                found, output = memory.get(key, mtime, version)
+                if found:
+                    if count:
+                        count_hit(output_path, start, None)
+                    return True, output
+            # load from cache
+            found, output = storage.load(output_path, version)
+            if found:
+                if memory is not None:
+                    memory.put(key, mtime, version, output)
+                if count:
+                    count_hit(output_path, start, _entry_size(output_path))
+            return found, output
+
+        def count_miss(output_path, compute_time, save_time, nbytes, mismatch):
+            stats.misses += 1
+            stats.version_mismatches += mismatch
+            stats.compute_time += compute_time
+            stats.save_time += save_time
+            stats.bytes_written += nbytes
+            if registry is not None:
+                registry.record(output_path, function_name, version, nbytes)
+            if callback is not None:
+                if mismatch:
+                    callback(function_name, "version_mismatch", output_path, 0.0, 0)
+                callback(function_name, "miss", output_path, compute_time, nbytes)
+
+        def save_entry(output_path, output, compute_time):
+            # an existing entry that was not loaded has another version
+            mismatch = not force_write and storage.mtime(output_path) is not None
+            start = time.perf_counter()
+            storage.save(output_path, output, version)
+            count_miss(output_path, compute_time, time.perf_counter() - start, _entry_size(output_path), mismatch)
+
+        def acquire_lock(output_path):
+            # return the acquired FileLock of the entry, or None if no lock is used
+            if not lock:
+                return None
+            file_lock = FileLock(output_path.with_name(f".{output_path.name}.lock"))
+            try:
+                file_lock.acquire()
+            except OSError:
+                # e.g. a read-only folder, compute without a lock
+                return None
+            return file_lock
+
+        if inspect.isgeneratorfunction(func):
+            wrapped_func = _wrap_generator(func, cache_path, acquire_lock, count_hit, count_miss, version, force_write,
+                                           resume_argument)
+            wrapped_func.stats = stats
+            return wrapped_func
+
+        if inspect.iscoroutinefunction(func):
+            return _wrap_async(func, cache_path, load_cached, acquire_lock, save_entry, stats, force_write,
+                               hash_inputs=inputs is not None)
+
+        @functools.wraps(func)
+        def wrapped_func(folder, *args, **kwargs):
+            output_path = cache_path(folder, *args, **kwargs)
+            if not force_write:
+                found, output = load_cached(output_path)
+                if found:
+                    return output
+
+            # only one process computes the entry, the others wait for the lock and then load the result
+            file_lock = acquire_lock(output_path)
+            try:
+                if file_lock is not None and not force_write:
+                    found, output = load_cached(output_path)
+                    if found:
+                        return output
+                # call the function
+                start = time.perf_counter()
+                output = func(folder, *args, **kwargs)
+                # save the result
+                save_entry(output_path, output, time.perf_counter() - start)
+            finally:
+                if file_lock is not None:
+                    file_lock.release()
             # return
             return output
+
+        def load(folder, *args, columns=None, row_groups=None, **kwargs):
+            """ load the output, or only some columns or row groups of a DataFrame output (with storage="columnar"),
+            computing it first if it is not cached """
+            options = {}
+            if columns is not None:
+                options["columns"] = columns
+            if row_groups is not None:
+                options["row_groups"] = row_groups
+            if options and not getattr(storage, "partial_reads", False):
+                raise ValueError(f"{type(storage).__name__} cannot read single columns or row groups, use "
+                                 f"storage=\"columnar\"")
+            output_path = cache_path(folder, *args, **kwargs)
+            if storage.mtime(output_path) is not None:
+                found, output = storage.load(output_path, version, **options)
+                if found:
+                    return output
+            wrapped_func(folder, *args, **kwargs)
+            return storage.load(output_path, version, **options)[1]
+
+        def map_folders(folders, *args, workers=None, executor="process", return_exceptions=False, **kwargs):
+            """ call the function for many folders, only the entries that are not cached yet are computed in parallel
+            :parameter
+            folders: the folders to call the function for, the other arguments are the same for all calls
+            workers: the number of parallel workers, defaults to the number of cpus
+            executor: "process", "thread" or a concurrent.futures.Executor to use, for "process" the decorated function
+                      needs to be defined at the module level
+            return_exceptions: weather to return the exception of a failed call in place of its result, otherwise the
+                               first exception is raised after all other calls finished and are cached
+            :return
+            the results in the order of the folders
+            """
+            from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+            folders = list(folders)
+            output_paths = [cache_path(folder, *args, **kwargs) for folder in folders]
+            results = [None] * len(folders)
+
+            # check which entries are already cached, a folder that appears twice is only computed once
+            missing = {}
+            for index, output_path in enumerate(output_paths):
+                if not force_write and storage.mtime(output_path) is not None:
+                    found, output = load_cached(output_path)
+                    if found:
+                        results[index] = output
+                        continue
+                missing.setdefault(output_path, []).append(index)
+
+            errors = {}
+            if missing:
+                if isinstance(executor, Executor):
+                    pool = executor
+                elif executor == "process":
+                    pool = ProcessPoolExecutor(workers)
+                elif executor == "thread":
+                    pool = ThreadPoolExecutor(workers or os.cpu_count())
+                else:
+                    raise ValueError(f"unknown executor {executor!r}, use \"process\", \"thread\" or an Executor")
+                try:
+                    futures = {pool.submit(_compute_entry, wrapped_func, folders[indices[0]], args, kwargs): output_path
+                               for output_path, indices in missing.items()}
+                    for future, output_path in futures.items():
+                        try:
+                            pid, counters = future.result()
+                            if pid != os.getpid():
+                                stats.add(counters)
+                            found, output = load_cached(output_path, count=False)
+                            if not found:
+                                raise FileNotFoundError(f"the cache entry {output_path} was not written")
+                        except Exception as err:
+                            errors[output_path] = err
+                            output = err
+                        for index in missing[output_path]:
+                            results[index] = output
+                finally:
+                    if pool is not executor:
+                        pool.shutdown()
+
+            if errors and not return_exceptions:
+                raise next(iter(errors.values()))
+            return results
+
+        wrapped_func.cache_path = cache_path
+        wrapped_func.load = load
+        wrapped_func.map = map_folders
+        wrapped_func.stats = stats
         return wrapped_func
     return wrap
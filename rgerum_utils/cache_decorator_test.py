@@ -1,6 +1,8 @@
 from cache_decorator import cache
 from mock_dir import MockDir
 import numpy as np
+from pathlib import Path
+import time
 
 # to test we create an artificial folder structure
 file_structure = {
@@ -131,4 +133,530 @@ def test_different_version():
             results2.append(func(f"tmp/run-{i}", i))
 
         for r, r2 in zip(results, results2):
-            assert (r != r2).all()
\ No newline at end of file
+            assert (r != r2).all()
+
+def test_content_hash():
+    calls = 0
+    @cache("out.npz", content_hash=True)
+    def func(folder, i, scale=1):
+        nonlocal calls
+        calls += 1
+        return np.ones(i) * scale
+
+    with MockDir(file_structure):
+        func("tmp/run-1", 2)
+        func("tmp/run-1", 2)
+        assert calls == 1
+        # an argument that is not part of the filename still gets its own cache file
+        assert (np.array(func("tmp/run-1", 2, scale=3)) == 3).all()
+        assert calls == 2
+        assert (np.array(func("tmp/run-1", 2)) == 1).all()
+        assert calls == 2
+        assert func.cache_path("tmp/run-1", 2) != func.cache_path("tmp/run-1", 2, scale=3)
+
+        # a change of the function code uses a new cache file
+        @cache("out.npz", content_hash=True)
+        def func(folder, i, scale=1):
+            nonlocal calls
+            calls += 1
+            return np.ones(i) * scale * 2
+
+        assert (np.array(func("tmp/run-1", 2)) == 2).all()
+        assert calls == 3
+
+
+def test_content_hash_set():
+    import os
+    import subprocess
+    import sys
+    # the hash of a set does not depend on the hash seed of the process
+    code = ("import hashlib; from cache_decorator import _hash_value; h = hashlib.blake2b(); "
+            "_hash_value(h, [{'alpha', 'beta', 'gamma'}, frozenset([1, 'a'])]); print(h.hexdigest())")
+    hashes = set()
+    for seed in ["1", "2", "3"]:
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=str(Path(__file__).parent.parent))
+        result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent, capture_output=True, text=True,
+                                check=True, env=env)
+        hashes.add(result.stdout)
+    assert len(hashes) == 1
+
+
+def test_content_hash_inputs():
+    import time
+    calls = 0
+    @cache("out.npz", inputs=["*.txt"])
+    def func(folder):
+        nonlocal calls
+        calls += 1
+        return np.array([len(open(file).read()) for file in sorted(Path(folder).glob("*.txt"))])
+
+    with MockDir(file_structure):
+        Path("tmp/run-1/input.txt").write_text("abc")
+        assert list(func("tmp/run-1")) == [3]
+        assert list(func("tmp/run-1")) == [3]
+        assert calls == 1
+        # changing an input file recomputes the result
+        time.sleep(0.01)
+        Path("tmp/run-1/input.txt").write_text("abcdef")
+        assert list(func("tmp/run-1")) == [6]
+        assert calls == 2
+
+
+def test_memory_cache():
+    import os
+    from cache_decorator import MemoryCache
+    memory = MemoryCache(max_entries=2)
+    @cache("out_{i}.npz", memory=memory)
+    def func(folder, i):
+        return dict(i=i, data=np.arange(10))
+
+    with MockDir(file_structure):
+        # the first call computes the result, the second loads it from the file and keeps it in memory
+        func("tmp/run-1", 1)
+        first = func("tmp/run-1", 1)
+        assert memory.stats()["misses"] == 1
+        assert func("tmp/run-1", 1) is first
+        assert memory.stats()["hits"] == 1
+
+        # a changed file is loaded again
+        os.utime(func.cache_path("tmp/run-1", 1), ns=(0, 0))
+        second = func("tmp/run-1", 1)
+        assert second is not first
+        assert second["i"] == 1
+        assert memory.stats()["misses"] == 2
+
+        # only max_entries results are kept
+        for i in range(2, 4):
+            func("tmp/run-1", i)
+            func("tmp/run-1", i)
+        assert memory.stats()["entries"] == 2
+        assert memory.stats()["evictions"] == 1
+
+
+def test_npy_storage():
+    calls = 0
+    @cache("out_{kind}", storage="npy")
+    def func(folder, kind):
+        nonlocal calls
+        calls += 1
+        if kind == "array":
+            return np.arange(12).reshape(3, 4)
+        if kind == "tuple":
+            return np.arange(3), np.ones((2, 2))
+        if kind == "dict":
+            return dict(a=np.arange(3), b=np.zeros(2))
+        return dict(a=1, foo="foo")
+
+    with MockDir(file_structure):
+        for kind in ["array", "tuple", "dict", "other"]:
+            func("tmp/run-1", kind)
+        assert calls == 4
+
+        # the arrays are loaded memory-mapped
+        array = func("tmp/run-1", "array")
+        assert isinstance(array, np.memmap)
+        assert (array[1] == [4, 5, 6, 7]).all()
+        a, b = func("tmp/run-1", "tuple")
+        assert isinstance(a, np.memmap) and (a == np.arange(3)).all() and b.shape == (2, 2)
+        data = func("tmp/run-1", "dict")
+        assert sorted(data) == ["a", "b"] and (data["b"] == 0).all()
+        # other outputs are pickled
+        assert func("tmp/run-1", "other") == dict(a=1, foo="foo")
+        assert calls == 4
+
+
+def test_columnar_storage():
+    import pandas as pd
+    calls = 0
+    @cache("out_{n}", storage="columnar")
+    def func(folder, n):
+        nonlocal calls
+        calls += 1
+        data = pd.DataFrame(dict(a=np.arange(n), b=np.arange(n) * 2.0, c=[f"x{i}" for i in range(n)]))
+        return data, np.arange(3), "info"
+
+    with MockDir(file_structure):
+        data, array, info = func("tmp/run-1", 10)
+        data2, array2, info2 = func("tmp/run-1", 10)
+        assert calls == 1
+        pd.testing.assert_frame_equal(data, data2)
+        assert (array == array2).all() and info2 == "info"
+
+        # load only some columns
+        data3, _, _ = func.load("tmp/run-1", 10, columns=["b"])
+        assert list(data3.columns) == ["b"]
+        assert calls == 1
+
+        # load only some row groups
+        from cache_decorator import ColumnarStorage
+        @cache("out_{n}_rows", storage=ColumnarStorage(row_group_size=4))
+        def func2(folder, n):
+            return pd.DataFrame(dict(a=np.arange(n), c=[f"x{i}" for i in range(n)]))
+
+        data = func2.load("tmp/run-1", 10, row_groups=[1, 2])
+        assert list(data.a) == [4, 5, 6, 7, 8, 9]
+
+
+def test_load():
+    import pytest
+    calls = 0
+    for storage in ["npz", "npy"]:
+        @cache(f"out_{{i}}.{storage}", storage=storage)
+        def func(folder, i):
+            nonlocal calls
+            calls += 1
+            return np.arange(i)
+
+        with MockDir(file_structure):
+            # the other storages load the whole output
+            assert list(func.load("tmp/run-1", 3)) == [0, 1, 2]
+            assert list(func.load("tmp/run-1", 3)) == [0, 1, 2]
+            with pytest.raises(ValueError, match="columnar"):
+                func.load("tmp/run-1", 3, columns=["a"])
+    assert calls == 2
+
+
+def test_compute_once():
+    import multiprocessing
+    @cache("out.npz")
+    def func(folder):
+        # count the calls in a file, as they happen in different processes
+        with open("tmp/calls.txt", "a") as fp:
+            fp.write("x")
+        time.sleep(0.5)
+        return np.arange(3)
+
+    with MockDir(file_structure):
+        # a fork keeps the local function and the current directory
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=func, args=("tmp/run-1",)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert all(process.exitcode == 0 for process in processes)
+        assert Path("tmp/calls.txt").read_text() == "x"
+        assert (func("tmp/run-1") == np.arange(3)).all()
+        # no lock or temporary files are left behind
+        assert sorted(p.name for p in Path("tmp/run-1").iterdir()) == ["out.npz"]
+
+
+def test_stale_lock(monkeypatch):
+    import json
+    import os
+    import subprocess
+    import sys
+    from cache_decorator import FileLock
+
+    with MockDir(file_structure):
+        # a lock of a process that does not exist anymore is removed right away
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        Path("tmp/run-1/.out.npz.lock").write_text(json.dumps(dict(host=FileLock.hostname, pid=process.pid, token="old")))
+
+        @cache("out.npz")
+        def func(folder):
+            return np.arange(3)
+
+        start = time.time()
+        assert (func("tmp/run-1") == np.arange(3)).all()
+        assert time.time() - start < 5
+        assert not Path("tmp/run-1/.out.npz.lock").exists()
+
+        # a lock that was not refreshed for stale_after seconds is removed
+        Path("tmp/lock").write_text(json.dumps(dict(host="other-host", pid=1, token="old")))
+        os.utime("tmp/lock", (time.time() - 10, time.time() - 10))
+        lock = FileLock("tmp/lock", stale_after=5)
+        assert lock.acquire(timeout=2)
+        assert json.loads(Path("tmp/lock").read_text())["token"] == lock.token
+        # a lock held by another owner is not acquired
+        assert not FileLock("tmp/lock", stale_after=5).acquire(timeout=0.3)
+        lock.release()
+        assert not Path("tmp/lock").exists()
+
+        # a lock that was replaced by a new owner while it was removed is not deleted
+        def replace(source, target):
+            # another process removes the stale lock and takes it, then a third one creates a lock
+            os_replace(source, target)
+            Path("tmp/moved").write_text(json.dumps(dict(host="other-host", pid=1, token="new")))
+            os_replace("tmp/moved", target)
+            Path("tmp/lock").write_text(json.dumps(dict(host="other-host", pid=1, token="third")))
+
+        Path("tmp/lock").write_text(json.dumps(dict(host="other-host", pid=1, token="old")))
+        os.utime("tmp/lock", (time.time() - 10, time.time() - 10))
+        os_replace = os.replace
+        monkeypatch.setattr(os, "replace", replace)
+        FileLock("tmp/lock", stale_after=5)._remove_if_stale()
+        monkeypatch.undo()
+        assert json.loads(Path("tmp/lock").read_text())["token"] == "third"
+        moved = [path for path in Path("tmp").iterdir() if path.name.startswith(".lock.")]
+        assert len(moved) == 1 and json.loads(moved[0].read_text())["token"] == "new"
+
+
+@cache("squares_{n}.npz")
+def squares(folder, n):
+    # defined at the module level, so that it can be sent to worker processes
+    if "fail" in str(folder):
+        raise ValueError(folder)
+    return np.arange(n) ** 2
+
+
+def test_map():
+    structure = {"tmp": {"run-1": [], "run-2": [], "run-3": [], "run-fail": []}}
+    with MockDir(structure):
+        # one entry is already cached
+        squares("tmp/run-2", 3)
+        folders = ["tmp/run-1", "tmp/run-2", "tmp/run-3", "tmp/run-1"]
+        results = squares.map(folders, 3, workers=2)
+        assert all(list(result) == [0, 1, 4] for result in results)
+        assert all(Path(folder, "squares_3.npz").exists() for folder in folders)
+
+        # failures are reported per item
+        results = squares.map(["tmp/run-fail", "tmp/run-1"], n=4, executor="thread", return_exceptions=True)
+        assert isinstance(results[0], ValueError) and list(results[1]) == [0, 1, 4, 9]
+        try:
+            squares.map(["tmp/run-fail", "tmp/run-3"], 5, executor="thread")
+            assert False, "the error should be raised"
+        except ValueError:
+            pass
+        # the other items are cached anyway
+        assert Path("tmp/run-3/squares_5.npz").exists()
+
+
+def test_async():
+    import asyncio
+    calls = 0
+    @cache("out_{i}.npz")
+    async def func(folder, i):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return np.arange(i)
+
+    async def main():
+        # concurrent calls for the same entry share one computation
+        results = await asyncio.gather(*[func("tmp/run-1", 3) for _ in range(100)])
+        assert calls == 1
+        assert all(list(result) == [0, 1, 2] for result in results)
+        # the next calls load the cache
+        assert list(await func("tmp/run-1", 3)) == [0, 1, 2]
+        await asyncio.gather(func("tmp/run-1", 3), func("tmp/run-1", 4), func("tmp/run-2", 4))
+        assert calls == 3
+
+    with MockDir(file_structure):
+        asyncio.run(main())
+        assert Path("tmp/run-1/out_3.npz").exists()
+
+
+def test_registry():
+    import os
+    import subprocess
+    import sys
+    from cache_decorator import CacheRegistry
+
+    with MockDir(file_structure):
+        registry = CacheRegistry("tmp/registry.sqlite")
+
+        @cache("out_{i}.npz", registry=registry)
+        def func(folder, i):
+            return np.zeros(i * 1000)
+
+        @cache("other.npz", version=2, registry=registry)
+        def func2(folder):
+            return np.zeros(10)
+
+        for i in range(1, 4):
+            func("tmp/run-1", i)
+        func2("tmp/run-2")
+        entries = registry.entries()
+        assert len(entries) == 4
+        assert registry.total_size() == sum(os.path.getsize(entry[0]) for entry in entries)
+        assert [entry[2] for entry in registry.entries("func2")] == [2]
+
+        # the access times are updated on a hit, so out_1 becomes the most recently used entry
+        time.sleep(0.01)
+        func("tmp/run-1", 1)
+        registry.flush()
+        removed = registry.prune(max_bytes=registry.total_size() - 1)
+        assert [Path(entry[0]).name for entry in removed] == ["out_2.npz"]
+        assert not Path("tmp/run-1/out_2.npz").exists()
+
+        # invalidate by function
+        removed = registry.invalidate(function="func2", dry_run=True)
+        assert len(removed) == 1 and Path("tmp/run-2/other.npz").exists()
+        registry.invalidate(function="func2")
+        assert not Path("tmp/run-2/other.npz").exists()
+        assert len(registry.entries()) == 2
+
+        # measure a folder with unregistered cache files
+        np.savez("tmp/run-2/untracked.npz", output=1)
+        assert registry.scan("tmp", ["*.npz"])[0] == 3
+        assert len(registry.entries()) == 3
+        registry.close()
+
+        # the command line interface
+        root = Path(__file__).parent.parent
+        result = subprocess.run([sys.executable, "-m", "rgerum_utils.cache", "--registry", "tmp/registry.sqlite",
+                                 "invalidate", "--function", "func"], capture_output=True, text=True, check=True,
+                                env=dict(os.environ, PYTHONPATH=str(root)))
+        assert "2 entries" in result.stdout
+        assert sorted(p.name for p in Path("tmp/run-1").iterdir()) == []
+
+
+def test_codec():
+    import pytest
+    from cache_decorator import NpzStorage
+    data = np.zeros((100, 1000))
+    data[::7, ::3] = np.arange(1000)[::3]
+    codecs = ["zlib", "zlib:9", "lzma"]
+    for package, codec in [("lz4", "lz4"), ("zstandard", "zstd:3")]:
+        try:
+            __import__(package)
+            codecs.append(codec)
+        except ImportError:
+            pass
+
+    with MockDir(file_structure):
+        np.savez("tmp/run-1/plain.npz", output=data[:50], version=1)
+        for codec in codecs:
+            calls = 0
+            @cache("out.npz", codec=codec)
+            def func(folder, n):
+                nonlocal calls
+                calls += 1
+                return data[:n]
+
+            assert (np.array(func("tmp/run-2", 50)) == data[:50]).all()
+            # the default storage reads the codec from the file
+            assert (np.array(cache("out.npz")(func)("tmp/run-2", 50)) == data[:50]).all()
+            assert calls == 1
+            assert Path("tmp/run-2/out.npz").stat().st_size < Path("tmp/run-1/plain.npz").stat().st_size / 4
+            Path("tmp/run-2/out.npz").unlink()
+
+        # other outputs are pickled
+        storage = NpzStorage("zlib")
+        storage.save("tmp/run-2/dict.npz", dict(a=1, b="b"), 1)
+        assert storage.load("tmp/run-2/dict.npz", 1) == (True, dict(a=1, b="b"))
+
+        # large outputs are split into chunks
+        storage = NpzStorage("zlib", chunk_size=1000)
+        storage.save("tmp/run-2/chunks.npz", data, 1)
+        with np.load("tmp/run-2/chunks.npz") as loaded:
+            assert len(loaded["offsets"]) > 10
+        assert (np.array(storage.load("tmp/run-2/chunks.npz", 1)[1]) == data).all()
+
+        with pytest.raises(ValueError):
+            cache("out.npz", codec="unknown")
+
+
+def test_stats():
+    from cache_decorator import function_stats
+    events = []
+    def callback(function, event, path, seconds, nbytes):
+        events.append((event, Path(path).name, nbytes > 0))
+
+    def func(folder, i):
+        return np.arange(i)
+
+    with MockDir(file_structure):
+        cached = cache("out_{i}.npz", callback=callback, memory=True)(func)
+        for i in [1, 2, 1, 1]:
+            cached("tmp/run-1", i)
+        stats = cached.stats
+        assert function_stats[stats.function] is stats
+        assert (stats.hits, stats.memory_hits, stats.misses, stats.version_mismatches) == (2, 1, 2, 0)
+        assert stats.bytes_written == sum(p.stat().st_size for p in Path("tmp/run-1").iterdir())
+        assert stats.bytes_read == Path("tmp/run-1/out_1.npz").stat().st_size
+        assert stats.compute_time > 0 and stats.load_time > 0
+        assert events == [("miss", "out_1.npz", True), ("miss", "out_2.npz", True), ("hit", "out_1.npz", True),
+                          ("memory_hit", "out_1.npz", False)]
+
+        # a new version replaces the entry
+        cached = cache("out_{i}.npz", version=2)(func)
+        cached("tmp/run-1", 1)
+        assert (cached.stats.misses, cached.stats.version_mismatches) == (1, 1)
+
+        # the stats of worker processes are added to the stats of the caller
+        squares.stats.reset()
+        squares.map(["tmp/run-1", "tmp/run-2"], 2, workers=2)
+        squares.map(["tmp/run-1", "tmp/run-2"], 2, workers=2)
+        assert (squares.stats.misses, squares.stats.hits) == (2, 2)
+
+
+def test_generator():
+    import pytest
+    from cache_decorator import ChunkedResult
+    computed = []
+    fail_at = None
+
+    def frames(folder, n, start=0):
+        for i in range(start, n):
+            if i == fail_at:
+                raise RuntimeError("killed")
+            computed.append(i)
+            yield np.full(3, i) if i % 2 == 0 else dict(frame=i)
+
+    with MockDir(file_structure):
+        func = cache("frames_{n}", resume_argument="start")(frames)
+        # the run is interrupted, the complete chunks are kept
+        fail_at = 5
+        with pytest.raises(RuntimeError):
+            func("tmp/run-1", 8)
+        assert computed == [0, 1, 2, 3, 4]
+        # and the next run continues after them
+        fail_at = None
+        result = func("tmp/run-1", 8)
+        assert computed == [0, 1, 2, 3, 4, 5, 6, 7]
+        assert isinstance(result, ChunkedResult) and len(result) == 8
+        assert isinstance(result[2], np.memmap) and list(result[2]) == [2, 2, 2]
+        assert result[-1] == dict(frame=7)
+        assert [chunk["frame"] for chunk in result[1::2]] == [1, 3, 5, 7]
+
+        # a full hit does not call the function
+        assert len(func("tmp/run-1", 8)) == 8
+        assert len(computed) == 8 and func.stats.hits == 1 and func.stats.misses == 1
+
+        # without a resume argument the complete chunks are computed again but not written again
+        computed.clear()
+        func = cache("frames_{n}_noresume")(frames)
+        fail_at = 2
+        with pytest.raises(RuntimeError):
+            func("tmp/run-1", 4)
+        fail_at = None
+        mtime = Path("tmp/run-1/frames_4_noresume/0.npy").stat().st_mtime_ns
+        assert len(func("tmp/run-1", 4)) == 4
+        assert computed == [0, 1, 0, 1, 2, 3]
+        assert Path("tmp/run-1/frames_4_noresume/0.npy").stat().st_mtime_ns == mtime
+
+        # a new version starts from the beginning
+        func = cache("frames_{n}", version=2, resume_argument="start")(frames)
+        computed.clear()
+        assert len(func("tmp/run-1", 8)) == 8
+        assert computed == list(range(8))
+        assert func.stats.version_mismatches == 1
+
+
+def test_argument_binder():
+    import inspect
+    import pytest
+    import warnings
+    from cache_decorator import _argument_binder
+
+    def simple(folder, a, b=2, c="c"):
+        pass
+
+    def variadic(folder, a, *args, b=2, **kwargs):
+        pass
+
+    calls = [(simple, ("f", 1), {}), (simple, ("f",), dict(a=1, c=3)), (simple, ("f", 1, 2, 3), {}),
+             (variadic, ("f", 1, 2, 3), dict(d=4)), (variadic, ("f",), dict(a=1, b=3))]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        for func, args, kwargs in calls:
+            assert _argument_binder(func)(*args, **kwargs) == inspect.getcallargs(func, *args, **kwargs)
+
+    # wrong calls raise a TypeError
+    for args, kwargs in [(("f",), {}), (("f", 1), dict(a=1)), (("f", 1), dict(d=1)), (("f", 1, 2, 3, 4), {}),
+                         (("f",), dict(b=1, d=1))]:
+        with pytest.raises(TypeError):
+            _argument_binder(simple)(*args, **kwargs)
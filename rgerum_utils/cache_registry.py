@@ -0,0 +1,235 @@
+import atexit
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+
+def _entry_size(path):
+    # the size in bytes of a cache file, or of all files in a cache folder
+    try:
+        if not os.path.isdir(path):
+            return os.stat(path).st_size
+    except OSError:
+        return 0
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.stat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _remove_entry(path):
+    # remove a cache file or cache folder
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class CacheRegistry:
+    """ a registry of the cache entries written by @cache(..., registry=...), stored in an sqlite file
+
+    For every entry the absolute path, the function, the version, the size in bytes and the creation and last access
+    times are recorded. Entries can then be listed, evicted to stay below a total size or age, or invalidated by
+    function or version, also with "python -m rgerum_utils.cache".
+    :parameter
+    registry_file: the sqlite file, defaults to a file in the user cache folder
+    max_bytes: if given, the entries are evicted regularly to keep their total size below max_bytes
+    max_age: if given, entries older than max_age seconds are evicted regularly
+    policy: "lru" to evict the least recently accessed entries first and measure the age from the last access, or
+            "age" to evict the oldest entries first and measure the age from the creation
+    prune_interval: the minimal time in seconds between two automatic evictions
+    """
+    columns = ("path", "function", "version", "size", "created", "accessed")
+
+    def __init__(self, registry_file=None, max_bytes=None, max_age=None, policy="lru", prune_interval=60):
+        if registry_file is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+            registry_file = Path(cache_home) / "rgerum_utils" / "cache_registry.sqlite"
+        self.registry_file = Path(registry_file)
+        self.registry_file.parent.mkdir(parents=True, exist_ok=True)
+        if policy not in ("lru", "age"):
+            raise ValueError(f"unknown policy {policy!r}, use \"lru\" or \"age\"")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.policy = policy
+        self.prune_interval = prune_interval
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        # the access times are written in batches, not on every hit
+        self._accessed = {}
+        self._last_flush = time.time()
+        self._last_prune = 0
+        atexit.register(self.flush)
+
+    @property
+    def connection(self):
+        # a forked worker process opens its own connection
+        if self._pid != os.getpid():
+            import sqlite3
+            self._connection = sqlite3.connect(str(self.registry_file), timeout=60, check_same_thread=False)
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, function TEXT, version, size INTEGER,
+                                                    created REAL, accessed REAL) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS entries_function ON entries (function);
+            """)
+            self._pid = os.getpid()
+        return self._connection
+
+    def record(self, path, function=None, version=None, size=None):
+        """ add or update the entry of a cache file or folder that was just written """
+        if not isinstance(version, (int, float, str, type(None))):
+            version = repr(version)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                    (os.path.abspath(path), function, version,
+                                     _entry_size(path) if size is None else size, now, now))
+        if (self.max_bytes is not None or self.max_age is not None) and now - self._last_prune > self.prune_interval:
+            self._last_prune = now
+            self.prune()
+
+    def touch(self, path):
+        """ update the last access time of an entry """
+        now = time.time()
+        with self.lock:
+            self._accessed[os.path.abspath(path)] = now
+        if now - self._last_flush > 1:
+            self.flush()
+
+    def flush(self):
+        """ write the pending access times """
+        with self.lock:
+            accessed, self._accessed = self._accessed, {}
+            self._last_flush = time.time()
+            if accessed:
+                with self.connection:
+                    self.connection.executemany("UPDATE entries SET accessed=? WHERE path=?",
+                                                [(t, path) for path, t in accessed.items()])
+
+    def entries(self, function=None, version=None):
+        """ the entries as tuples of (path, function, version, size, created, accessed), optionally only of one
+        function (its module and qualified name or only its name) or version """
+        self.flush()
+        query, parameters = "SELECT * FROM entries WHERE 1", []
+        if function is not None:
+            query += " AND (function=? OR substr(function, ?)=?)"
+            parameters += [function, -len(function) - 1, "." + function]
+        if version is not None:
+            query += " AND version=?"
+            parameters.append(version)
+        with self.lock:
+            return self.connection.execute(query + " ORDER BY path", parameters).fetchall()
+
+    def total_size(self):
+        """ the total size in bytes of all entries """
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def remove(self, paths, dry_run=False):
+        """ delete the given cache entries from the disk and the registry """
+        if not dry_run:
+            for path in paths:
+                _remove_entry(path)
+            with self.lock, self.connection:
+                self.connection.executemany("DELETE FROM entries WHERE path=?", [(path,) for path in paths])
+
+    def invalidate(self, function=None, version=None, stale=False, dry_run=False):
+        """ delete the entries of a function and/or version, with stale=True only the entries with a lower version than
+        the highest recorded version of their function, returns the removed entries """
+        entries = self.entries(function, version)
+        if stale:
+            newest = {}
+            for entry in entries:
+                if isinstance(entry[2], (int, float)):
+                    newest[entry[1]] = max(newest.get(entry[1], entry[2]), entry[2])
+            entries = [entry for entry in entries if entry[1] in newest and entry[2] < newest[entry[1]]]
+        self.remove([entry[0] for entry in entries], dry_run)
+        return entries
+
+    def prune(self, max_bytes=None, max_age=None, policy=None, dry_run=False):
+        """ evict entries older than max_age seconds and then the oldest entries until the total size is below
+        max_bytes, the limits and policy default to the ones of the registry, returns the removed entries """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        column = "accessed" if (policy or self.policy) == "lru" else "created"
+        self.flush()
+        with self.lock:
+            rows = self.connection.execute(f"SELECT * FROM entries ORDER BY {column}").fetchall()
+        index = self.columns.index(column)
+        removed = []
+        total = sum(row[3] for row in rows)
+        now = time.time()
+        for row in rows:
+            too_old = max_age is not None and row[index] < now - max_age
+            too_large = max_bytes is not None and total > max_bytes
+            if not too_old and not too_large:
+                break
+            removed.append(row)
+            total -= row[3]
+        self.remove([row[0] for row in removed], dry_run)
+        return removed
+
+    def scan(self, root, patterns=("*.npz",)):
+        """ add the cache files below root that match one of the patterns and are not registered yet, update the
+        sizes of the registered ones, and drop registered entries below root that do not exist anymore, returns the
+        number of entries and their total size """
+        import fnmatch
+        root = os.path.abspath(root)
+        found = {}
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                iterator = os.scandir(directory)
+            except OSError:
+                continue
+            with iterator:
+                for entry in iterator:
+                    if any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in patterns):
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        size = _entry_size(entry.path) if entry.is_dir(follow_symlinks=False) else stat.st_size
+                        found[entry.path] = (size, stat.st_mtime)
+                    elif entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+
+        with self.lock, self.connection:
+            prefix = root.rstrip(os.sep) + os.sep
+            known = {path for path, in self.connection.execute("SELECT path FROM entries WHERE substr(path, 1, ?)=?",
+                                                               (len(prefix), prefix))}
+            self.connection.executemany("DELETE FROM entries WHERE path=?", [(path,) for path in known - set(found)])
+            self.connection.executemany("UPDATE entries SET size=? WHERE path=?",
+                                        [(found[path][0], path) for path in known & set(found)])
+            self.connection.executemany("INSERT INTO entries VALUES (?, NULL, NULL, ?, ?, ?)",
+                                        [(path, size, mtime, mtime) for path, (size, mtime) in found.items()
+                                         if path not in known])
+        return len(found), sum(size for size, _ in found.values())
+
+    def close(self):
+        self.flush()
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._pid = None
+
+
+_default_registry = None
+
+
+def default_registry():
+    """ the registry used by @cache(..., registry=True) """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = CacheRegistry()
+    return _default_registry
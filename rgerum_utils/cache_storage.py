@@ -0,0 +1,420 @@
+import functools
+import json
+import os
+import pickle
+import shutil
+import sys
+import uuid
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+
+def _temp_path(path):
+    # a unique hidden path next to the target, so that the final rename stays on the same file system
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _replace_directory(source, target):
+    # move a completely written folder to its target, an existing folder is moved away first and removed afterwards
+    target = Path(target)
+    old = None
+    if target.exists():
+        old = _temp_path(target)
+        os.replace(target, old)
+    os.replace(source, target)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+@functools.lru_cache()
+def _codec_functions(codec):
+    """ the compress(data) and decompress(data) functions of a codec like "zlib", "zlib:6", "lzma", "lz4" or "zstd:3",
+    lz4 and zstd need the optional packages lz4 and zstandard """
+    name, _, level = codec.partition(":")
+    level = int(level) if level else None
+    if name == "zlib":
+        import zlib
+        level = 1 if level is None else level
+        return lambda data: zlib.compress(data, level), zlib.decompress
+    if name == "lzma":
+        import lzma
+        level = 0 if level is None else level
+        return lambda data: lzma.compress(data, preset=level), lzma.decompress
+    if name == "lz4":
+        import lz4.frame
+        level = 0 if level is None else level
+        return lambda data: lz4.frame.compress(data, compression_level=level), lz4.frame.decompress
+    if name == "zstd":
+        import zstandard
+        level = 3 if level is None else level
+        return (lambda data: zstandard.ZstdCompressor(level=level).compress(data),
+                lambda data: zstandard.ZstdDecompressor().decompress(data))
+    raise ValueError(f"unknown codec {codec!r}, use \"zlib\", \"lzma\", \"lz4\" or \"zstd\" with an optional level")
+
+
+_codec_pool = None
+
+
+def _map_chunks(function, chunks):
+    # the codecs release the GIL, so the chunks of large outputs are (de)compressed in parallel
+    global _codec_pool
+    if len(chunks) <= 1:
+        return [function(chunk) for chunk in chunks]
+    if _codec_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _codec_pool = ThreadPoolExecutor(min(8, os.cpu_count() or 1))
+    return list(_codec_pool.map(function, chunks))
+
+
+class NpzStorage:
+    """ the default storage of @cache, the output and the version are stored in a single .npz file
+
+    With a codec the output is serialized in the .npy format, split into chunks and each chunk is compressed. The
+    codec is stored in the file, so that any NpzStorage can read it.
+    :parameter
+    codec: None for no compression, or "zlib", "lzma", "lz4" or "zstd" with an optional level, e.g. "zstd:3", a codec
+           which package is not installed falls back to "zlib:1"
+    chunk_size: the size in bytes of the chunks that are compressed independently
+    """
+    def __init__(self, codec=None, chunk_size=2**22):
+        if codec is not None:
+            try:
+                _codec_functions(codec)
+            except ImportError as err:
+                import warnings
+                warnings.warn(f"codec {codec!r} is not available ({err}), using \"zlib:1\" instead")
+                codec = "zlib:1"
+        self.codec = codec
+        self.chunk_size = chunk_size
+
+    def mtime(self, output_path):
+        """ the modification time of the stored entry in ns, or None if there is none """
+        try:
+            return os.stat(output_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, output_path, version):
+        """ return (True, output) if the entry has the current version, else (False, None) """
+        with np.load(output_path, allow_pickle=True) as loaded:
+            # only return it if the version is the current one
+            if loaded.get("version", None) == version:
+                if "codec" in loaded:
+                    output = self._decompress(str(loaded["codec"]), loaded["offsets"], loaded["data"])
+                else:
+                    output = loaded["output"]
+                try:
+                    return True, tuple(output)
+                except TypeError:
+                    return True, output[()]
+        return False, None
+
+    def save(self, output_path, output, version):
+        if self.codec is None:
+            arrays = dict(output=output)
+        else:
+            offsets, data = self._compress(output)
+            arrays = dict(codec=self.codec, offsets=offsets, data=data)
+        # write to a temporary file and rename it, so that no other process can read a partially written file
+        temp_path = _temp_path(output_path)
+        try:
+            with open(temp_path, "wb") as fp:
+                np.savez(fp, version=version, **arrays)
+            os.replace(temp_path, output_path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def _compress(self, output):
+        # serialize like np.savez would and compress the chunks, returns the chunk offsets and the concatenated chunks
+        import io
+        buffer = io.BytesIO()
+        np.lib.format.write_array(buffer, np.asanyarray(output), allow_pickle=True)
+        raw = buffer.getbuffer()
+        chunks = [raw[i:i + self.chunk_size] for i in range(0, max(len(raw), 1), self.chunk_size)]
+        compressed = _map_chunks(_codec_functions(self.codec)[0], chunks)
+        offsets = np.cumsum([0] + [len(chunk) for chunk in compressed])
+        return offsets, np.frombuffer(b"".join(compressed), dtype=np.uint8)
+
+    @staticmethod
+    def _decompress(codec, offsets, data):
+        import io
+        chunks = [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        raw = _map_chunks(_codec_functions(codec)[1], chunks)
+        return np.lib.format.read_array(io.BytesIO(b"".join(raw)), allow_pickle=True)
+
+
+class NpyStorage:
+    """ store ndarray outputs, or tuples or dicts of them, as raw .npy files in a folder and load them memory-mapped
+
+    The arrays are only read from disk when they are accessed, which allows slicing large results without loading
+    them completely. The filename of the cache is used as the folder name. Other outputs are stored in an .npz file
+    in the folder.
+    """
+    meta_name = "meta.json"
+
+    def __init__(self, mmap_mode="r"):
+        self.mmap_mode = mmap_mode
+
+    def mtime(self, output_path):
+        # the metadata is written last, so it marks a complete entry
+        try:
+            return os.stat(Path(output_path) / self.meta_name).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, output_path, version):
+        output_path = Path(output_path)
+        with open(output_path / self.meta_name) as fp:
+            meta = json.load(fp)
+        if meta.get("version", None) != version:
+            return False, None
+        if meta["type"] == "npz":
+            return NpzStorage().load(output_path / "output.npz", version)
+        arrays = [np.load(output_path / f"{i}.npy", mmap_mode=self.mmap_mode) for i in range(meta["count"])]
+        if meta["type"] == "array":
+            return True, arrays[0]
+        if meta["type"] == "tuple":
+            return True, tuple(arrays)
+        return True, dict(zip(meta["keys"], arrays))
+
+    def save(self, output_path, output, version):
+        # write to a temporary folder and rename it, so that no other process can read a partially written entry
+        temp_path = _temp_path(output_path)
+        try:
+            temp_path.mkdir()
+            self._write(temp_path, output, version)
+            _replace_directory(temp_path, output_path)
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def _write(self, output_path, output, version):
+        meta = dict(version=version)
+        if self._is_plain_array(output):
+            meta.update(type="array", count=1)
+            arrays = [output]
+        elif isinstance(output, tuple) and all(self._is_plain_array(item) for item in output):
+            meta.update(type="tuple", count=len(output))
+            arrays = output
+        elif isinstance(output, dict) and all(isinstance(key, str) and self._is_plain_array(item)
+                                              for key, item in output.items()):
+            meta.update(type="dict", count=len(output), keys=list(output))
+            arrays = list(output.values())
+        else:
+            meta.update(type="npz")
+            arrays = []
+            np.savez(output_path / "output.npz", output=output, version=version)
+        for i, array in enumerate(arrays):
+            np.save(output_path / f"{i}.npy", array)
+        with open(output_path / self.meta_name, "w") as fp:
+            json.dump(meta, fp)
+
+    @staticmethod
+    def _is_plain_array(value):
+        # object arrays cannot be memory-mapped
+        return isinstance(value, np.ndarray) and not value.dtype.hasobject
+
+
+class ChunkedResult(Sequence):
+    """ a lazy view of the chunks of a generator function cached with @cache, a chunk is only loaded when it is
+    accessed, plain arrays memory-mapped """
+    def __init__(self, path, count, version, mmap_mode="r"):
+        self.path = Path(path)
+        self.count = count
+        self.version = version
+        self.mmap_mode = mmap_mode
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("chunk index out of range")
+        path = self.path / f"{index}.npy"
+        if path.exists():
+            return np.load(path, mmap_mode=self.mmap_mode)
+        return NpzStorage().load(self.path / f"{index}.npz", self.version)[1]
+
+    def concatenate(self, axis=0):
+        """ load all chunks and join them into one array """
+        return np.concatenate(list(self), axis=axis)
+
+    def __repr__(self):
+        return f"ChunkedResult({str(self.path)!r}, {self.count} chunks)"
+
+
+class ChunkedStorage:
+    """ store the chunks yielded by a generator function in a folder, one .npy file per plain array chunk and one .npz
+    file for other chunks
+
+    Every chunk is written with an atomic rename as soon as it is yielded, so the complete chunks of an interrupted
+    run are kept. The metadata with the version is written when a run starts and marked complete when it ends.
+    """
+    meta_name = "meta.json"
+
+    def __init__(self, mmap_mode="r"):
+        self.mmap_mode = mmap_mode
+
+    def _read_meta(self, output_path):
+        try:
+            with open(Path(output_path) / self.meta_name) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, output_path, meta):
+        temp_path = _temp_path(Path(output_path) / self.meta_name)
+        with open(temp_path, "w") as fp:
+            json.dump(meta, fp)
+        os.replace(temp_path, Path(output_path) / self.meta_name)
+
+    def state(self, output_path, version):
+        """ return (number of complete chunks, weather the run is complete), or None if the folder contains the chunks
+        of another version """
+        meta = self._read_meta(output_path)
+        if meta is None:
+            return 0, False
+        if meta.get("version", None) != version:
+            return None
+        if meta.get("complete", False):
+            return meta["count"], True
+        count = 0
+        while (Path(output_path) / f"{count}.npy").exists() or (Path(output_path) / f"{count}.npz").exists():
+            count += 1
+        return count, False
+
+    def load(self, output_path, version):
+        """ return (True, ChunkedResult) if the run is complete and has the current version, else (False, None) """
+        state = self.state(output_path, version)
+        if state is None or not state[1]:
+            return False, None
+        return True, ChunkedResult(output_path, state[0], version, self.mmap_mode)
+
+    def start(self, output_path, version):
+        """ remove the chunks of a previous run and start a new one """
+        shutil.rmtree(output_path, ignore_errors=True)
+        Path(output_path).mkdir(parents=True)
+        self._write_meta(output_path, dict(version=version, complete=False))
+
+    def append(self, output_path, index, chunk, version):
+        """ write a chunk, returns its size in bytes """
+        if NpyStorage._is_plain_array(chunk):
+            path = Path(output_path) / f"{index}.npy"
+            temp_path = _temp_path(path)
+            try:
+                with open(temp_path, "wb") as fp:
+                    np.save(fp, chunk)
+                os.replace(temp_path, path)
+            finally:
+                temp_path.unlink(missing_ok=True)
+        else:
+            path = Path(output_path) / f"{index}.npz"
+            NpzStorage().save(path, chunk, version)
+        return os.stat(path).st_size
+
+    def finish(self, output_path, version, count):
+        self._write_meta(output_path, dict(version=version, complete=True, count=count))
+
+
+def _is_dataframe(value):
+    # check for a DataFrame without importing pandas
+    return "pandas" in sys.modules and isinstance(value, sys.modules["pandas"].DataFrame)
+
+
+class ColumnarStorage(NpyStorage):
+    """ store DataFrame outputs, or tuples containing DataFrames, as parquet files in a folder (using pyarrow)
+
+    Single columns or row groups can be read with func.load(folder, ..., columns=[...], row_groups=[...]) without
+    reading the whole table. DataFrames that parquet cannot store are pickled, other items of tuples are stored like
+    in NpyStorage and other outputs like in NpyStorage.
+    :parameter
+    row_group_size: the number of rows of a row group, the unit for partial reads of rows
+    """
+    # func.load can pass columns and row_groups to the load method
+    partial_reads = True
+
+    def __init__(self, row_group_size=100_000, mmap_mode="r"):
+        super().__init__(mmap_mode)
+        self.row_group_size = row_group_size
+
+    def _write(self, output_path, output, version):
+        if _is_dataframe(output):
+            items = [output]
+        elif isinstance(output, tuple) and any(_is_dataframe(item) for item in output):
+            items = list(output)
+        else:
+            return super()._write(output_path, output, version)
+
+        kinds = []
+        for i, item in enumerate(items):
+            if _is_dataframe(item):
+                try:
+                    item.to_parquet(output_path / f"{i}.parquet", engine="pyarrow", row_group_size=self.row_group_size)
+                    kinds.append("parquet")
+                    continue
+                except (ImportError, TypeError, ValueError, NotImplementedError):
+                    # e.g. columns with mixed types or without pyarrow, fall back to pickle
+                    pass
+            elif self._is_plain_array(item):
+                np.save(output_path / f"{i}.npy", item)
+                kinds.append("npy")
+                continue
+            with open(output_path / f"{i}.pkl", "wb") as fp:
+                pickle.dump(item, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            kinds.append("pickle")
+        meta = dict(version=version, type="columnar", tuple=not _is_dataframe(output), items=kinds,
+                    row_group_size=self.row_group_size)
+        with open(output_path / self.meta_name, "w") as fp:
+            json.dump(meta, fp)
+
+    def load(self, output_path, version, columns=None, row_groups=None):
+        """ return (True, output) if the entry has the current version, else (False, None)
+        :parameter
+        columns: only read these columns of the DataFrames
+        row_groups: only read these row groups (blocks of row_group_size rows) of the DataFrames
+        """
+        output_path = Path(output_path)
+        with open(output_path / self.meta_name) as fp:
+            meta = json.load(fp)
+        if meta.get("version", None) != version:
+            return False, None
+        if meta["type"] != "columnar":
+            return super().load(output_path, version)
+
+        items = []
+        for i, kind in enumerate(meta["items"]):
+            if kind == "parquet":
+                import pyarrow.parquet as pq
+                with pq.ParquetFile(output_path / f"{i}.parquet") as parquet_file:
+                    if row_groups is not None:
+                        table = parquet_file.read_row_groups(row_groups, columns=columns, use_pandas_metadata=True)
+                    else:
+                        table = parquet_file.read(columns=columns, use_pandas_metadata=True)
+                items.append(table.to_pandas())
+            elif kind == "npy":
+                items.append(np.load(output_path / f"{i}.npy", mmap_mode=self.mmap_mode))
+            else:
+                with open(output_path / f"{i}.pkl", "rb") as fp:
+                    item = pickle.load(fp)
+                if _is_dataframe(item):
+                    # select the columns and row groups after loading the whole table
+                    if columns is not None:
+                        item = item[columns]
+                    if row_groups is not None:
+                        size = meta["row_group_size"]
+                        item = item.iloc[[row for group in row_groups
+                                          for row in range(group * size, min((group + 1) * size, len(item)))]]
+                items.append(item)
+        if meta["tuple"]:
+            return True, tuple(items)
+        return True, items[0]
+
+
+# the storages that can be selected by name in @cache(..., storage=...)
+storages = dict(npz=NpzStorage(), npy=NpyStorage(), columnar=ColumnarStorage())
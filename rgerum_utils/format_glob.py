@@ -1,86 +1,750 @@
+import numpy as np
 import pandas as pd
 from pathlib import Path
+import functools
 import glob
+import hashlib
+import itertools
+import os
+import queue
+import re
+import sqlite3
+import stat
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
-def format_glob(pattern, return_template=False):
-    import re
-    pattern = str(Path(pattern))
+def _pattern_to_regex(pattern):
+    # escape the pattern and translate the wildcards and the {name}, {name:d}, {name:f} placeholders to groups
     regexp_string = re.escape(pattern).replace("\\*\\*/", ".*").replace("\\*", ".*")
     regexp_string = re.sub(r"\\{([^}]*):f\\}", r"(?P<__float__\1>[0-9.]*)", regexp_string)
     regexp_string = re.sub(r"\\{([^}]*):d\\}", r"(?P<__int__\1>[0-9]*)", regexp_string)
     regexp_string = re.sub(r"\\{([^}]*)\\}", r"(?P<\1>.*)", regexp_string)
+    return regexp_string
 
-    if return_template is True:
-        regexp_string3 = ""
-        replacement = ""
-        count = 1
-        for part in re.split(r"(\([^)]*\))", regexp_string):
-            if part.startswith("("):
-                regexp_string3 += part
-                replacement += f"{{{part[4:-4]}}}"
-                count += 1
-            else:
-                regexp_string3 += f"({part})"
-                replacement += f"\\{count}"
-                count += 1
 
-    regexp_string2 = re.compile(regexp_string)
-    glob_string = re.sub(r"({[^}]*})", "*", pattern)
+def _split_pattern(pattern):
+    """ split a normalized pattern into the literal base directory and the matchers for each directory level below """
+    parts = pattern.split(os.sep)
+    # the leading parts without wildcards or placeholders form the base directory
+    base_count = 0
+    while base_count < len(parts) - 1 and "*" not in parts[base_count] and "{" not in parts[base_count]:
+        base_count += 1
+    base = os.sep.join(parts[:base_count])
+    if base == "" and base_count > 0:
+        base = os.sep
 
-    output_base = glob_string
-    while "*" in str(output_base):
-        output_base = Path(output_base).parent
+    segments = []
+    for part in parts[base_count:]:
+        if part == "**":
+            segments.append(("**", None))
+        elif "*" in part or "{" in part:
+            segments.append(("match", re.compile(_pattern_to_regex(part))))
+        else:
+            segments.append(("literal", part))
+    return base, segments
 
-    for file in output_base.rglob(str(Path(glob_string).relative_to(output_base))):#glob.glob(glob_string, recursive=True):
-        file = str(Path(file))
-        match = regexp_string2.match(file)
-        if match is None:  # pragma: no cover
-            continue
-        group = match.groupdict()
-        group["filename"] = file
-        group2 = {}
-        for col in group.keys():
+
+def _scandir(directory):
+    # list a directory as (name, is_dir, is_symlink) tuples, unreadable directories are treated as empty
+    try:
+        with os.scandir(directory or ".") as it:
+            entries = []
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:  # pragma: no cover
+                    is_dir = False
+                entries.append((entry.name, is_dir, entry.is_symlink()))
+            return entries
+    except OSError:
+        return []
+
+
+def _stat_path(path):
+    # return None if the path does not exist, otherwise whether it is a directory
+    try:
+        return stat.S_ISDIR(os.stat(path).st_mode)
+    except OSError:
+        return None
+
+
+def _walk_pattern(base, segments, list_dir=_scandir, stat_path=_stat_path, workers=None, ordered=False):
+    """ yield all paths below base that match the segments, only descending into directories that can still match
+
+    With workers > 1 the directories are listed concurrently in a thread pool. The paths are then yielded as soon as they
+    are found, or in the same order as the sequential walk if ordered is True.
+    """
+    seen = set()
+    seen_lock = threading.Lock()
+
+    def expand(directory, index):
+        # list one directory level, the result contains the matching paths and the (directory, index) states to visit next
+        kind, matcher = segments[index]
+        last = index == len(segments) - 1
+        items = []
+        if kind == "**":
+            # multiple ** segments can reach the same directory on different ways
+            with seen_lock:
+                if (directory, index) in seen:
+                    return items
+                seen.add((directory, index))
+            # ** matches zero levels, a trailing ** matches all directories below (like Path.rglob)
+            if not last:
+                items.append((directory, index + 1))
+            # or one or more levels (symlinks are not followed to avoid cycles)
+            for name, is_dir, is_symlink in list_dir(directory):
+                if not is_dir:
+                    continue
+                path = os.path.join(directory, name)
+                if last:
+                    items.append(path)
+                if not is_symlink:
+                    items.append((path, index))
+        elif kind == "literal":
+            # a literal level only needs a stat and no directory listing
+            path = os.path.join(directory, matcher)
+            is_dir = stat_path(path)
+            if last:
+                if is_dir is not None:
+                    items.append(path)
+            elif is_dir:
+                items.append((path, index + 1))
+        else:
+            for name, is_dir, is_symlink in list_dir(directory):
+                if matcher.fullmatch(name) is None:
+                    continue
+                path = os.path.join(directory, name)
+                if last:
+                    items.append(path)
+                elif is_dir:
+                    items.append((path, index + 1))
+        return items
+
+    if workers is None or workers <= 1:
+        def walk(directory, index):
+            for item in expand(directory, index):
+                if isinstance(item, str):
+                    yield item
+                else:
+                    yield from walk(*item)
+
+        yield from walk(base, 0)
+        return
+
+    executor = ThreadPoolExecutor(workers)
+    found = queue.Queue()
+    pending = 0
+    pending_lock = threading.Lock()
+
+    def submit(state):
+        nonlocal pending
+        with pending_lock:
+            pending += 1
+        return executor.submit(task, state)
+
+    def task(state):
+        nonlocal pending
+        try:
+            # start listing the subdirectories right away, the states are replaced by their futures
+            items = [item if isinstance(item, str) else submit(item) for item in expand(*state)]
+        except BaseException as err:
+            if not ordered:
+                found.put(err)
+            raise
+        if not ordered:
+            found.put([item for item in items if isinstance(item, str)])
+        with pending_lock:
+            pending -= 1
+            # the last task signals the end of the walk
+            if pending == 0:
+                found.put(None)
+        return items
+
+    try:
+        root = submit((base, 0))
+        if ordered:
+            # consume the tree depth first, waiting for the listings in the order of the sequential walk
+            stack = [root]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, str):
+                    yield item
+                else:
+                    stack.extend(reversed(item.result()))
+        else:
+            while True:
+                files = found.get()
+                if files is None:
+                    break
+                if isinstance(files, BaseException):
+                    raise files
+                yield from files
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DirectoryIndex:
+    """ a persistent listing of a directory tree, stored in an sqlite file, that format_glob can query instead of the file system
+
+    A directory is only listed again when its modification time changed since it was indexed, so repeated queries on
+    large or slow file systems only cost one stat per visited directory.
+    :parameter
+    root: the directory to index, directories outside of it are listed directly from the file system
+    index_file: the sqlite file to store the index in, defaults to a file in the user cache folder
+    validate: weather to compare the modification times of the directories, if False the stored listings are trusted
+    """
+    def __init__(self, root, index_file=None, validate=True):
+        self.root = os.path.abspath(root)
+        if index_file is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+            index_file = Path(cache_home) / "rgerum_utils" / f"index_{hashlib.sha1(self.root.encode()).hexdigest()}.sqlite"
+        self.index_file = Path(index_file)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        self.validate = validate
+        # the connection is shared with the worker threads of format_glob
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.index_file), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime INTEGER) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS entries (directory TEXT, name TEXT, is_dir INTEGER, is_symlink INTEGER,
+                                                PRIMARY KEY (directory, name)) WITHOUT ROWID;
+        """)
+
+    def _key(self, directory):
+        # directories are stored relative to the root, None for directories outside of the root
+        relative = os.path.relpath(os.path.abspath(directory or "."), self.root)
+        if relative == ".":
+            return ""
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        return relative
+
+    def _refresh(self, directory, key):
+        # list the directory again if it is new or its modification time changed, returns the new listing or None
+        with self.lock:
+            row = self.connection.execute("SELECT mtime FROM directories WHERE path=?", (key,)).fetchone()
+        if row is not None and not self.validate:
+            return None
+        try:
+            # get the time before listing, so that changes during the listing are picked up by the next query
+            mtime = os.stat(directory or ".").st_mtime_ns
+        except OSError:
+            mtime = None
+        if row is not None and row[0] == mtime:
+            return None
+
+        entries = _scandir(directory) if mtime is not None else []
+        with self.lock, self.connection:
+            # only replace the listing of this directory, the subdirectories are validated by their own mtime
+            self.connection.execute("DELETE FROM directories WHERE path=?", (key,))
+            self.connection.execute("DELETE FROM entries WHERE directory=?", (key,))
+            if mtime is not None:
+                self.connection.execute("INSERT INTO directories VALUES (?, ?)", (key, mtime))
+                self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)",
+                                            [(key, name, is_dir, is_symlink) for name, is_dir, is_symlink in entries])
+        return entries
+
+    def list_dir(self, directory):
+        """ list a directory as (name, is_dir, is_symlink) tuples """
+        key = self._key(directory)
+        if key is None:
+            return _scandir(directory)
+        entries = self._refresh(directory, key)
+        if entries is not None:
+            return entries
+        with self.lock:
+            rows = self.connection.execute("SELECT name, is_dir, is_symlink FROM entries WHERE directory=?", (key,)).fetchall()
+        return [(name, bool(is_dir), bool(is_symlink)) for name, is_dir, is_symlink in rows]
+
+    def stat_path(self, path):
+        """ return None if the path does not exist, otherwise whether it is a directory """
+        directory, name = os.path.split(path)
+        key = self._key(directory)
+        if key is None or name == "":
+            return _stat_path(path)
+        self._refresh(directory, key)
+        with self.lock:
+            row = self.connection.execute("SELECT is_dir FROM entries WHERE directory=? AND name=?", (key, name)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def update(self):
+        """ bring the whole index up to date, only listing the directories that changed """
+        directories = [self.root]
+        while directories:
+            directory = directories.pop()
+            for name, is_dir, is_symlink in self.list_dir(directory):
+                if is_dir and not is_symlink:
+                    directories.append(os.path.join(directory, name))
+        return self
+
+    def close(self):
+        self.connection.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _default_index(root):
+    # the index=True queries of one base directory share one DirectoryIndex and its sqlite connection
+    return DirectoryIndex(root)
+
+
+class FormatPattern:
+    """ a compiled format pattern, with the regular expressions and type conversions prepared for repeated use
+
+    Use FormatPattern.compile(pattern) to reuse the compiled patterns from an LRU cache.
+    :parameter
+    pattern: a path pattern with * and ** wildcards and {name}, {name:d} (int) or {name:f} (float) placeholders
+    """
+    def __init__(self, pattern):
+        self.pattern = str(Path(pattern))
+        self.regexp_string = _pattern_to_regex(self.pattern)
+        self.regexp = re.compile(self.regexp_string)
+        # the output name and type conversion of every group of the regular expression
+        self.converters = []
+        for col in self.regexp.groupindex:
             if col.startswith("__float__"):
-                group2[col[len("__float__"):]] = float(group[col])
+                self.converters.append((col, col[len("__float__"):], float))
             elif col.startswith("__int__"):
-                group2[col[len("__int__"):]] = int(group[col])
+                self.converters.append((col, col[len("__int__"):], int))
             else:
-                group2[col] = group[col]
-        group = group2
+                self.converters.append((col, col, None))
+        self.base, self.segments = _split_pattern(self.pattern)
+        self.format_string = re.sub(r"{([^}]*):f}", r"{\1}", self.pattern)
+        self._template = None
+        self._lines_regexp = None
+
+    @staticmethod
+    def compile(pattern):
+        """ get the compiled pattern from the cache, or compile it """
+        return _compile_format_pattern(str(pattern))
+
+    @property
+    def template(self):
+        # the regular expression and replacement to get the template name of a file, only compiled when needed
+        if self._template is None:
+            regexp_string3 = ""
+            replacement = ""
+            count = 1
+            for part in re.split(r"(\([^)]*\))", self.regexp_string):
+                if part.startswith("("):
+                    regexp_string3 += part
+                    replacement += f"{{{part[4:-4]}}}"
+                    count += 1
+                else:
+                    regexp_string3 += f"({part})"
+                    replacement += f"\\{count}"
+                    count += 1
+            self._template = (re.compile(regexp_string3), replacement)
+        return self._template
+
+    def match(self, path, return_template=False):
+        """ return the values of the placeholders and the filename if the path matches the pattern, otherwise None """
+        match = self.regexp.fullmatch(path)
+        if match is None:
+            return None
+        values = match.groupdict()
+        group = {}
+        for col, name, converter in self.converters:
+            if converter is None:
+                group[name] = values[col]
+                continue
+            # e.g. an empty {name:d} or a {name:f} with several dots
+            try:
+                group[name] = converter(values[col])
+            except ValueError:
+                return None
+        group["filename"] = path
         if return_template:
-            template_name = re.sub(regexp_string3, replacement, file)
-            group["template"] = template_name
-        yield file, group
+            regexp, replacement = self.template
+            group["template"] = regexp.sub(replacement, path)
+        return group
 
+    def glob(self, root=None, return_template=False, index=None, workers=None, ordered=False):
+        """ iterate over all files matching the pattern (relative to root if given), yielding the filename and the values """
+        if root is not None:
+            yield from FormatPattern.compile(Path(root) / self.pattern).glob(
+                return_template=return_template, index=index, workers=workers, ordered=ordered)
+            return
+        for file in self.files(index=index, workers=workers, ordered=ordered):
+            group = self.match(file, return_template)
+            if group is None:  # pragma: no cover
+                continue
+            yield file, group
 
-def format_glob_pd(pattern, return_template=False):
-    data = []
-    for _, d in format_glob(pattern, return_template):
-        data.append(d)
-    if len(data) == 0:
-        print(path_not_found_message(pattern), file=sys.stderr)
-    return pd.DataFrame(data)
-
-
-def path_not_found_message(name):
-    def levenshteinDistance(str1, str2):
-        m = len(str1)
-        n = len(str2)
-        d = [[i] for i in range(1, m + 1)]  # d matrix rows
-        d.insert(0, list(range(0, n + 1)))  # d matrix columns
-        for j in range(1, n + 1):
-            for i in range(1, m + 1):
-                if str1[i - 1] == str2[j - 1]:  # Python (string) is 0-based
-                    substitutionCost = 0
+    def files(self, index=None, workers=None, ordered=False):
+        """ iterate over the paths that can match the pattern, without extracting the placeholder values """
+        # walk the directory tree level by level, only entering directories that can still match the pattern
+        if index is True:
+            index = _default_index(os.path.abspath(self.base or "."))
+        if index is not None:
+            return _walk_pattern(self.base, self.segments, list_dir=index.list_dir, stat_path=index.stat_path,
+                                 workers=workers, ordered=ordered)
+        return _walk_pattern(self.base, self.segments, workers=workers, ordered=ordered)
+
+    def match_pd(self, filenames, return_template=False, categories=True):
+        """ extract the placeholder values of many filenames at once into a DataFrame, filenames that do not match are dropped
+        :parameter
+        filenames: a list or Series of filenames
+        return_template: weather to add a column with the template name of each file
+        categories: weather to store string columns with repeated values as categories to save memory
+        """
+        filenames = list(filenames)
+        joined = "\n".join(filenames)
+        if joined.count("\n") == max(len(filenames) - 1, 0):
+            # match all filenames in one pass over the joined lines
+            if self._lines_regexp is None:
+                self._lines_regexp = re.compile("^" + self.regexp_string + "$", re.MULTILINE)
+                # the lookahead group additionally captures the whole line, to know which filenames matched
+                self._lines_regexp_filename = re.compile("^(?=(.*))" + self.regexp_string + "$", re.MULTILINE)
+            found = self._lines_regexp.findall(joined)
+            if len(found) != len(filenames):
+                found = self._lines_regexp_filename.findall(joined)
+                if len(self.converters) == 0:
+                    filenames, found = found, []
                 else:
-                    substitutionCost = 1
-                d[i].insert(j, min(d[i - 1][j] + 1,
-                                   d[i][j - 1] + 1,
-                                   d[i - 1][j - 1] + substitutionCost))
-        return d[-1][-1]
+                    filenames = [f[0] for f in found]
+                    found = [f[1:] for f in found]
+            elif len(self.converters) == 1:
+                # findall returns strings instead of tuples for a single group
+                found = [(f,) for f in found]
+        else:
+            # filenames with line breaks are matched one by one
+            matches = [(file, self.regexp.fullmatch(file)) for file in filenames]
+            filenames = [file for file, match in matches if match is not None]
+            found = [match.groups() for file, match in matches if match is not None]
+
+        # convert only the unique values of each column and expand them again with the codes
+        factorized = []
+        keep = np.ones(len(found), dtype=bool)
+        for i, (col, name, converter) in enumerate(self.converters):
+            codes, uniques = pd.factorize(np.array([f[i] for f in found], dtype=object), sort=True)
+            if converter is not None:
+                values = np.zeros(len(uniques), dtype=np.int64 if converter is int else np.float64)
+                valid = np.ones(len(uniques), dtype=bool)
+                for j, value in enumerate(uniques):
+                    # e.g. an empty {name:d} or a {name:f} with several dots, the file is dropped like in match
+                    try:
+                        values[j] = converter(value)
+                    except ValueError:
+                        valid[j] = False
+                keep &= valid[codes]
+                uniques = values
+            factorized.append((codes, uniques))
+        filenames = np.array(filenames, dtype=object)
+        if not keep.all():
+            filenames = filenames[keep]
+            # drop the values that are no longer used
+            factorized = [(np.unique(codes[keep], return_inverse=True)[1], uniques[np.unique(codes[keep])])
+                          for codes, uniques in factorized]
+
+        columns = {}
+        for (col, name, converter), (codes, uniques) in zip(self.converters, factorized):
+            if converter is not None:
+                columns[name] = uniques[codes]
+            elif categories and len(uniques) <= len(filenames) // 2:
+                columns[name] = pd.Categorical.from_codes(codes, uniques)
+            else:
+                columns[name] = np.asarray(uniques, dtype=object)[codes]
+        columns["filename"] = filenames
+        data = pd.DataFrame(columns)
+
+        if return_template:
+            regexp, replacement = self.template
+            template = data["filename"].str.replace(regexp, replacement, regex=True)
+            if categories and template.nunique() <= len(template) // 2:
+                template = template.astype("category")
+            data["template"] = template
+        return data
+
+    def format(self, **fields):
+        """ fill the placeholders with the given values, e.g. to get the filename of a row of format_glob_pd """
+        for col, name, converter in self.converters:
+            if converter is float and name in fields:
+                # write floats in their shortest form, that is 3 and not 3.000000
+                value = repr(float(fields[name]))
+                fields[name] = value[:-2] if value.endswith(".0") else value
+        return self.format_string.format(**fields)
+
+    def __repr__(self):
+        return f"FormatPattern({self.pattern!r})"
+
+
+_compile_format_pattern = functools.lru_cache(maxsize=256)(FormatPattern)
+
+
+def format_glob(pattern, return_template=False, index=None, workers=None, ordered=False):
+    """ iterate over all files matching the pattern, yielding the filename and the values of the {name} placeholders
+    :parameter
+    pattern: a path pattern with * and ** wildcards and {name}, {name:d} (int) or {name:f} (float) placeholders
+    return_template: weather to add the pattern the file matched to the returned data
+    index: a DirectoryIndex to answer the query from, or True to use the default index of the pattern base directory
+    workers: the number of threads to list directories concurrently with, for file systems with a high latency
+    ordered: weather the files found by the workers should be returned in the same order as without workers
+    """
+    yield from FormatPattern.compile(pattern).glob(return_template=return_template, index=index, workers=workers,
+                                                   ordered=ordered)
+
+
+def _walk_patterns(base, segment_lists, list_dir=_scandir, stat_path=_stat_path):
+    """ walk below base once for several patterns, yielding (path, index of the pattern) for every pattern a path matches
+
+    Every directory is listed at most once, its entries are matched against the segments of all patterns that can still
+    match below it.
+    """
+    seen = set()
+
+    def walk(directory, states):
+        # expand the ** segments that match zero levels
+        active = set()
+        todo = list(states)
+        while todo:
+            pattern, index = todo.pop()
+            segments = segment_lists[pattern]
+            if segments[index][0] == "**":
+                # multiple ** segments can reach the same directory on different ways
+                if (directory, pattern, index) in seen:
+                    continue
+                seen.add((directory, pattern, index))
+                if index < len(segments) - 1:
+                    todo.append((pattern, index + 1))
+            active.add((pattern, index))
+
+        found = []
+        children = {}
+        entries = None
+        # a path matching several patterns is yielded for the first pattern first
+        for pattern, index in sorted(active):
+            kind, matcher = segment_lists[pattern][index]
+            last = index == len(segment_lists[pattern]) - 1
+            if kind == "literal":
+                # a literal level only needs a stat and no directory listing
+                path = os.path.join(directory, matcher)
+                is_dir = stat_path(path)
+                if last:
+                    if is_dir is not None:
+                        found.append((path, pattern))
+                elif is_dir:
+                    children.setdefault(path, []).append((pattern, index + 1))
+                continue
+            if entries is None:
+                entries = list_dir(directory)
+            for name, is_dir, is_symlink in entries:
+                if kind == "**":
+                    # a trailing ** matches all directories below, symlinks are not followed to avoid cycles
+                    if not is_dir:
+                        continue
+                    path = os.path.join(directory, name)
+                    if last:
+                        found.append((path, pattern))
+                    if not is_symlink:
+                        children.setdefault(path, []).append((pattern, index))
+                elif matcher.fullmatch(name) is not None:
+                    path = os.path.join(directory, name)
+                    if last:
+                        found.append((path, pattern))
+                    elif is_dir:
+                        children.setdefault(path, []).append((pattern, index + 1))
+        yield from found
+        for path, child_states in children.items():
+            yield from walk(path, child_states)
+
+    yield from walk(base, [(pattern, 0) for pattern in range(len(segment_lists))])
+
+
+def _plan_walks(patterns):
+    """ group compiled patterns by their base directory, a pattern below the base of another pattern joins its walk with
+    the remaining levels of its base as literal segments, returns a list of (base, pattern indices, segment lists) """
+    plans = []
+    for pattern_index in sorted(range(len(patterns)), key=lambda i: len(patterns[i].base)):
+        pattern = patterns[pattern_index]
+        for base, indices, segment_lists in plans:
+            if pattern.base == base:
+                relative = ""
+            elif base == "" and not os.path.isabs(pattern.base):
+                relative = pattern.base
+            elif pattern.base.startswith(base.rstrip(os.sep) + os.sep):
+                relative = pattern.base[len(base.rstrip(os.sep) + os.sep):]
+            else:
+                continue
+            literals = [("literal", part) for part in relative.split(os.sep) if part]
+            indices.append(pattern_index)
+            segment_lists.append(literals + pattern.segments)
+            break
+        else:
+            plans.append((pattern.base, [pattern_index], [pattern.segments]))
+    # keep the original order, a path matching several patterns is yielded for the first of them first
+    plans = [(base, sorted(indices), [segments for _, segments in sorted(zip(indices, segment_lists))])
+             for base, indices, segment_lists in plans]
+    return sorted(plans, key=lambda plan: plan[1][0])
+
+
+def format_glob_multi(patterns, return_template=False, index=None):
+    """ iterate over the files matching any of the patterns, yielding the filename, the values of its placeholders and
+    the pattern it matched
+
+    The patterns are grouped by their base directory and each directory is listed only once for all patterns. A file
+    that matches several patterns is returned once for each of them.
+    :parameter
+    patterns: a list of path patterns with * and ** wildcards and {name}, {name:d} or {name:f} placeholders
+    return_template: weather to add the pattern the file matched to the returned data
+    index: a DirectoryIndex to answer the queries from, or True to use the default index of each base directory
+    """
+    patterns = [FormatPattern.compile(pattern) for pattern in patterns]
+    for base, indices, segment_lists in _plan_walks(patterns):
+        if index is True:
+            base_index = _default_index(os.path.abspath(base or "."))
+            files = _walk_patterns(base, segment_lists, list_dir=base_index.list_dir, stat_path=base_index.stat_path)
+        elif index is not None:
+            files = _walk_patterns(base, segment_lists, list_dir=index.list_dir, stat_path=index.stat_path)
+        else:
+            files = _walk_patterns(base, segment_lists)
+        for file, i in files:
+            pattern = patterns[indices[i]]
+            group = pattern.match(file, return_template)
+            if group is None:  # pragma: no cover
+                continue
+            yield file, group, pattern.pattern
+
+
+def format_glob_pd(pattern, return_template=False, index=None, workers=None, categories=True, chunksize=None):
+    """ get all files matching the pattern as a DataFrame, with a column for each placeholder and the filename
+    :parameter
+    pattern: a path pattern with * and ** wildcards and {name}, {name:d} (int) or {name:f} (float) placeholders
+    return_template: weather to add a column with the pattern each file matched
+    index: a DirectoryIndex to answer the query from, or True to use the default index of the pattern base directory
+    workers: the number of threads to list directories concurrently with, for file systems with a high latency
+    categories: weather to store string columns with repeated values as categories to save memory
+    chunksize: if given, return an iterator of DataFrames with at most chunksize rows each instead of one DataFrame.
+               The chunks all have the same columns and dtypes, therefore strings are never stored as categories.
+    """
+    if chunksize is not None:
+        return _format_glob_pd_chunks(pattern, return_template, index, workers, chunksize)
+    format_pattern = FormatPattern.compile(pattern)
+    # collect only the filenames and extract the values column wise, in the same order with and without workers
+    filenames = list(format_pattern.files(index=index, workers=workers, ordered=True))
+    if len(filenames) == 0:
+        print(path_not_found_message(pattern), file=sys.stderr)
+        return pd.DataFrame([])
+    return format_pattern.match_pd(filenames, return_template=return_template, categories=categories)
+
+
+def _format_glob_pd_chunks(pattern, return_template, index, workers, chunksize):
+    format_pattern = FormatPattern.compile(pattern)
+    files = format_pattern.files(index=index, workers=workers, ordered=True)
+    found = False
+    while True:
+        filenames = list(itertools.islice(files, chunksize))
+        if len(filenames) == 0:
+            break
+        found = True
+        yield format_pattern.match_pd(filenames, return_template=return_template, categories=False)
+    if not found:
+        print(path_not_found_message(pattern), file=sys.stderr)
+
+
+def format_glob_write(pattern, filename, chunksize=100_000, return_template=False, index=None, workers=None):
+    """ write the DataFrame of format_glob_pd chunk by chunk to a parquet or feather file, without keeping all rows in memory
+    :parameter
+    pattern: a path pattern with * and ** wildcards and {name}, {name:d} (int) or {name:f} (float) placeholders
+    filename: the file to write, the format is chosen by the suffix (.parquet, or .feather/.arrow)
+    chunksize: the number of files to collect before they are written
+    :returns
+    the number of rows written, no file is written if no files match the pattern
+    """
+    # pyarrow is only needed for writing the files
+    import pyarrow as pa
+
+    suffix = Path(filename).suffix
+    if suffix == ".parquet":
+        import pyarrow.parquet as pq
+        create_writer = lambda schema: pq.ParquetWriter(str(filename), schema)
+    elif suffix in [".feather", ".arrow"]:
+        # feather files are arrow ipc files
+        create_writer = lambda schema: pa.ipc.new_file(str(filename), schema)
+    else:
+        raise ValueError(f"unknown file format \"{suffix}\", use .parquet, .feather or .arrow")
+
+    writer = None
+    count = 0
+    try:
+        for chunk in format_glob_pd(pattern, return_template=return_template, index=index, workers=workers,
+                                    chunksize=chunksize):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = create_writer(table.schema)
+            writer.write_table(table)
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def _edit_distance(str1, str2):
+    # the levenshtein distance with the bit-parallel algorithm of Myers (1999), one python int holds a column of the matrix
+    m = len(str1)
+    if m == 0:
+        return len(str2)
+    peq = {}
+    for i, c in enumerate(str1):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    for c in str2:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score
+
+
+def _most_similar_name(name, directory, max_distance=10, max_candidates=100_000):
+    """ find the entry of the directory with the smallest edit distance to name (the first one for ties), or None if
+    there is none closer than max_distance. Only the first max_candidates entries of the directory are compared. """
+    try:
+        with os.scandir(directory) as it:
+            candidates = [entry.name for entry in itertools.islice(it, max_candidates)]
+    except OSError:
+        return None
+    best_name = None
+    best_distance = max_distance
+    length = len(name)
+    characters = set(name)
+    for candidate in candidates:
+        # the length difference is a lower bound of the distance
+        if abs(len(candidate) - length) >= best_distance:
+            continue
+        # every character that does not appear in the other string needs at least one edit
+        if len(characters.symmetric_difference(candidate)) >= 2 * best_distance:
+            continue
+        distance = _edit_distance(name, candidate)
+        if distance < best_distance:
+            best_name = candidate
+            best_distance = distance
+            if distance == 0:
+                break
+    return best_name
+
 
+def path_not_found_message(name, max_candidates=100_000):
+    """ explain which part of the path does not exist and suggest the most similar existing file or folder
+    :parameter
+    name: the path or pattern that was not found
+    max_candidates: the maximum number of entries in the folder to compare for the suggestion
+    """
     # get a list of all parent folders
     name = Path(name).absolute()
     hierarchy = []
@@ -99,13 +763,7 @@ def path_not_found_message(name):
 
         # if it does not exist, we have found our problem
         if not exists:
-            similar_paths = list([p.name for p in path.parent.glob("*")])
-            distances = [levenshteinDistance(p, str(path.name)) for p in similar_paths]
-            import numpy as np
-            if len(distances) == 0:
-                distances = [np.inf]
-                similar_paths = ["none"]
-            i = np.argmin(distances)
+            similar_path = _most_similar_name(path.name, path.parent, max_candidates=max_candidates)
 
             target = f"no file/folder \"{path.name}\" found"
             if "*" in str(path.name):
@@ -116,8 +774,8 @@ def path_not_found_message(name):
                     source = f"in the only folder matching the pattern \"{path.parent}\""
                 else:
                     source = f"in any of the {parent_folder_count} folders matching the pattern \"{path.parent}\""
-            if distances[i] < 10:
-                return f"WARNING: {source} {target}. Did you mean \"{similar_paths[i]}\"?"
+            if similar_path is not None:
+                return f"WARNING: {source} {target}. Did you mean \"{similar_path}\"?"
             else:
                 return f"WARNING: {source} {target}"
         parent_folder_count = exists
@@ -1,5 +1,6 @@
 import pandas as pd
-from format_glob import format_glob, format_glob_pd, path_not_found_message
+import pytest
+from format_glob import format_glob, format_glob_pd, path_not_found_message, FormatPattern
 from pathlib import Path
 
 
@@ -148,3 +149,254 @@ def test_not_found_message():
         assert path_not_found_message("tmp/run-*/run_nodes5_name-Foo.txt") == F'WARNING: in any of the 2 folders matching the pattern "{Path().absolute()}/tmp/run-*" no file/folder "run_nodes5_name-Foo.txt" found'
         assert path_not_found_message("tmp/run-*/run_nodes5_name-*.txt") == F'WARNING: in any of the 2 folders matching the pattern "{Path().absolute()}/tmp/run-*" pattern "run_nodes5_name-*.txt" not found'
         assert path_not_found_message("tmp/*-1/run_nodes5_name-*.txt") == F'WARNING: in the only folder matching the pattern "{Path().absolute()}/tmp/*-1" pattern "run_nodes5_name-*.txt" not found'
+
+
+def test_recursive_glob():
+    from mock_dir import MockDir
+    # to test we create an artificial folder structure
+    file_structure = {
+        "tmp": {
+            "run-1": {"a": ["data_1.txt"], "b": {"c": ["data_2.txt"]}},
+            "run-2": ["data_3.txt", "other.txt"],
+        }
+    }
+    with MockDir(file_structure):
+        # ** matches any number of folder levels, including none
+        collected_data = sorted(filename for filename, data in format_glob("tmp/**/data_{i:d}.txt"))
+        assert collected_data == ["tmp/run-1/a/data_1.txt", "tmp/run-1/b/c/data_2.txt", "tmp/run-2/data_3.txt"]
+
+        # * only matches a single folder level
+        collected_data = sorted(filename for filename, data in format_glob("tmp/*/data_{i:d}.txt"))
+        assert collected_data == ["tmp/run-2/data_3.txt"]
+
+        # a pattern without any placeholder just checks whether the file exists
+        assert list(format_glob("tmp/run-2/other.txt")) == [("tmp/run-2/other.txt", {"filename": "tmp/run-2/other.txt"})]
+        assert list(format_glob("tmp/run-3/other.txt")) == []
+
+
+def test_directory_index(tmp_path, monkeypatch):
+    from mock_dir import MockDir
+    from format_glob import DirectoryIndex
+    # to test we create an artificial folder structure
+    file_structure = {
+        "tmp": {
+            "run-1": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Bob.txt"],
+            "run-2": ["run_nodes3_name-Foo.txt", "run_nodes4_name-Bar.txt"],
+        }
+    }
+    with MockDir(file_structure):
+        index = DirectoryIndex("tmp", index_file=tmp_path / "index.sqlite")
+        pattern = "tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt"
+        # the index gives the same results as walking the file system
+        assert sorted(format_glob(pattern, index=index)) == sorted(format_glob(pattern))
+        assert list(format_glob("tmp/run-1/run_nodes4_name-Bob.txt", index=index)) == [
+            ("tmp/run-1/run_nodes4_name-Bob.txt", {"filename": "tmp/run-1/run_nodes4_name-Bob.txt"})]
+
+        # a changed directory is listed again, an unchanged one is taken from the index
+        Path("tmp/run-2/run_nodes5_name-New.txt").touch()
+        index.connection.execute("UPDATE entries SET name='run_nodes6_name-Old.txt' WHERE name='run_nodes3_name-Alice.txt'")
+        names = sorted(data["name"] for _, data in format_glob(pattern, index=index))
+        assert names == ["Bar", "Bob", "Foo", "New", "Old"]
+
+        # a changed directory does not list its unchanged subdirectories again
+        Path("tmp/run-3").mkdir()
+        Path("tmp/run-3/run_nodes1_name-Third.txt").touch()
+        names = sorted(data["name"] for _, data in format_glob(pattern, index=index))
+        assert names == ["Bar", "Bob", "Foo", "New", "Old", "Third"]
+        Path("tmp/run-3/run_nodes1_name-Third.txt").unlink()
+        Path("tmp/run-3").rmdir()
+        names = sorted(data["name"] for _, data in format_glob(pattern, index=index))
+        assert names == ["Bar", "Bob", "Foo", "New", "Old"]
+        outer_index = DirectoryIndex(".", index_file=tmp_path / "outer_index.sqlite")
+        assert len(list(format_glob(pattern, index=outer_index))) == 5
+        outer_index.connection.execute("UPDATE entries SET name='run_nodes6_name-Old.txt' WHERE name='run_nodes4_name-Bar.txt'")
+        Path("tmp/new_folder").mkdir()
+        names = sorted(data["name"] for _, data in format_glob(pattern, index=outer_index))
+        assert names == ["Alice", "Bob", "Foo", "New", "Old"]
+        outer_index.close()
+
+        # the index is stored on disk and can be reused
+        index.close()
+        index = DirectoryIndex("tmp", index_file=tmp_path / "index.sqlite", validate=False)
+        names = sorted(data["name"] for _, data in format_glob(pattern, index=index))
+        assert names == ["Bar", "Bob", "Foo", "New", "Old"]
+        index.close()
+
+        # index=True reuses one index per base directory
+        from format_glob import _default_index, format_glob_multi
+        import os
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+        _default_index.cache_clear()
+        for i in range(3):
+            assert len(list(format_glob(pattern, index=True))) == 5
+            assert len(list(format_glob_multi([pattern], index=True))) == 5
+        assert _default_index.cache_info().currsize == 1
+        assert _default_index(os.path.abspath("tmp")).index_file.parent == tmp_path / "rgerum_utils"
+        _default_index(os.path.abspath("tmp")).close()
+        _default_index.cache_clear()
+
+
+def test_workers():
+    from mock_dir import MockDir
+    # to test we create an artificial folder structure
+    file_structure = {
+        "tmp": {
+            "run-1": {"a": ["data_1.txt", "data_2.txt"], "b": {"c": ["data_3.txt"]}},
+            "run-2": {"a": ["data_4.txt"], "b": ["data_5.txt", "data_6.txt"]},
+        }
+    }
+    with MockDir(file_structure):
+        pattern = "tmp/run-{run:d}/**/data_{i:d}.txt"
+        collected_data = list(format_glob(pattern))
+        assert len(collected_data) == 6
+        # the workers find the same files, with ordered=True also in the same order
+        assert sorted(format_glob(pattern, workers=4)) == sorted(collected_data)
+        assert list(format_glob(pattern, workers=4, ordered=True)) == collected_data
+        # the rows of the DataFrame do not depend on the timing of the workers
+        pd.testing.assert_frame_equal(format_glob_pd(pattern, workers=4), format_glob_pd(pattern))
+        pd.testing.assert_frame_equal(pd.concat(format_glob_pd(pattern, workers=4, chunksize=4), ignore_index=True),
+                                      format_glob_pd(pattern, categories=False))
+
+
+def test_format_pattern():
+    from mock_dir import MockDir
+    pattern = FormatPattern.compile("tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt")
+    # compiled patterns are cached
+    assert FormatPattern.compile("tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt") is pattern
+
+    # match filenames without accessing the file system
+    assert pattern.match("tmp/run-2/run_nodes7.5_name-Foo.txt") == {'run': 2, 'n': 7.5, 'name': 'Foo', 'filename': 'tmp/run-2/run_nodes7.5_name-Foo.txt'}
+    assert pattern.match("tmp/run-2/other.txt") is None
+    # the whole path has to match and the numbers have to be valid
+    assert pattern.match("tmp/run-2/run_nodes7.5_name-Foo.txt.bak") is None
+    assert pattern.match("tmp/run-2/run_nodes7.5_name-Foo.txt_old/other.csv") is None
+    assert pattern.match("tmp/run-/run_nodes7.5_name-Foo.txt") is None
+    assert pattern.match("tmp/run-2/run_nodes7.5.1_name-Foo.txt") is None
+
+    # fill in the placeholders
+    assert pattern.format(run=2, n=3.0, name="Foo") == "tmp/run-2/run_nodes3_name-Foo.txt"
+    assert pattern.format(**pattern.match("tmp/run-2/run_nodes7.5_name-Foo.txt")) == "tmp/run-2/run_nodes7.5_name-Foo.txt"
+
+    # glob the pattern relative to a root folder
+    file_structure = {
+        "tmp": {
+            "run-1": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Bob.txt"],
+            "run-2": ["run_nodes3_name-Foo.txt", "run_nodes4_name-Bar.txt"],
+        }
+    }
+    with MockDir(file_structure):
+        collected_data = sorted(FormatPattern("run-{run:d}/run_nodes{n:f}_name-{name}.txt").glob("tmp"))
+        assert collected_data == sorted(format_glob("tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt"))
+
+
+def test_pandas_dtypes():
+    from mock_dir import MockDir
+    # to test we create an artificial folder structure
+    file_structure = {
+        "tmp": {
+            "run-1": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Alice.txt", "run_nodes5_name-Bob.txt"],
+            "run-2": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Bob.txt", "run_nodes5_name-Bob.txt"],
+        }
+    }
+    with MockDir(file_structure):
+        df = format_glob_pd("tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt")
+        assert df.dtypes["run"] == "int64"
+        assert df.dtypes["n"] == "float64"
+        # repeated strings are stored as categories
+        assert isinstance(df.dtypes["name"], pd.CategoricalDtype)
+        assert df.dtypes["filename"] == object
+
+        # the values are the same as the ones from format_glob
+        target_data = pd.DataFrame([data for _, data in format_glob("tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt")])
+        pd.testing.assert_frame_equal(df, target_data, check_categorical=False, check_dtype=False)
+        pd.testing.assert_frame_equal(format_glob_pd("tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt", categories=False), target_data)
+
+    # filenames that do not match the pattern are dropped
+    df = FormatPattern.compile("run-{run:d}/{name}.txt").match_pd(["run-1/a.txt", "run-x/b.txt", "run-2/c.txt"])
+    assert list(df.run) == [1, 2]
+    assert list(df.filename) == ["run-1/a.txt", "run-2/c.txt"]
+    # and also the ones whose numbers can not be converted, like in format_glob
+    filenames = ["run-1/n1_a.txt", "run-/n2_b.txt", "run-2/n7.5.1_c.txt", "run-2/n3_a.txt", "run-3/n4.5_d.txt"]
+    pattern = FormatPattern.compile("run-{run:d}/n{n:f}_{name}.txt")
+    df = pattern.match_pd(filenames)
+    assert list(df.filename) == ["run-1/n1_a.txt", "run-2/n3_a.txt", "run-3/n4.5_d.txt"]
+    assert list(df.run) == [1, 2, 3] and list(df.n) == [1, 3, 4.5] and list(df.name) == ["a", "a", "d"]
+    assert list(df.filename) == [file for file in filenames if pattern.match(file) is not None]
+    with MockDir({"tmp": {"run-1": ["n1_a.txt"], "run-": ["n2_b.txt"], "run-2": ["n7.5.1_c.txt", "n3_a.txt"]}}):
+        df = format_glob_pd("tmp/run-{run:d}/n{n:f}_{name}.txt")
+        assert sorted(df.filename) == sorted(file for file, _ in format_glob("tmp/run-{run:d}/n{n:f}_{name}.txt"))
+        assert len(df) == 2
+    df = FormatPattern.compile("run-{run:d}/{name}.txt").match_pd(["run-1/a.txt", "run-2/b.txt.bak", "run-3/c.txt"])
+    assert list(df.filename) == ["run-1/a.txt", "run-3/c.txt"]
+    df = FormatPattern.compile("run-{run:d}/{name}.txt").match_pd(["run-1/a.txt\nx", "run-2/b.txt.bak"])
+    assert list(df.filename) == []
+
+
+def test_pandas_chunks(tmp_path):
+    from mock_dir import MockDir
+    from format_glob import format_glob_write
+    # to test we create an artificial folder structure
+    file_structure = {
+        "tmp": {
+            "run-1": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Bob.txt", "run_nodes5_name-Bob.txt"],
+            "run-2": ["run_nodes3_name-Foo.txt", "run_nodes4_name-Bar.txt"],
+        }
+    }
+    with MockDir(file_structure):
+        pattern = "tmp/run-{run:d}/run_nodes{n:f}_name-{name}.txt"
+        chunks = list(format_glob_pd(pattern, chunksize=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        for chunk in chunks:
+            assert list(chunk.columns) == ["run", "n", "name", "filename"]
+            assert list(chunk.dtypes) == list(chunks[0].dtypes)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), format_glob_pd(pattern, categories=False))
+
+        # write the chunks directly to a file
+        pytest.importorskip("pyarrow")
+        for suffix in [".parquet", ".feather"]:
+            assert format_glob_write(pattern, tmp_path / ("files" + suffix), chunksize=2) == 5
+        pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "files.parquet"), pd.concat(chunks, ignore_index=True))
+        pd.testing.assert_frame_equal(pd.read_feather(tmp_path / "files.feather"), pd.concat(chunks, ignore_index=True))
+
+
+def test_edit_distance():
+    from format_glob import _edit_distance
+    assert _edit_distance("kitten", "sitting") == 3
+    assert _edit_distance("", "abc") == 3
+    assert _edit_distance("run-3", "run-2") == 1
+    assert _edit_distance("a" * 100 + "b", "a" * 100) == 1
+
+    from mock_dir import MockDir
+    file_structure = {"tmp": {"run-1": [], "run-2": []}}
+    with MockDir(file_structure):
+        # the suggestion can be disabled by limiting the number of compared folder entries
+        assert path_not_found_message("tmp/run-3", max_candidates=0) == F'WARNING: in folder "{Path().absolute()}/tmp" no file/folder "run-3" found'
+
+
+def test_format_glob_multi():
+    from mock_dir import MockDir
+    from format_glob import format_glob_multi, _plan_walks
+    listed = []
+    def list_dir(directory):
+        from format_glob import _scandir
+        listed.append(directory)
+        return _scandir(directory)
+
+    patterns = ["tmp/run-{run:d}/run_nodes{n:d}_name-{name}.txt", "tmp/*/run_nodes7_name-{name}.txt",
+                "tmp/run-1/run_nodes{n:f}_name-Bar.txt", "tmp/**/*.csv"]
+    file_structure2 = {"tmp": {"run-1": ["run_nodes3_name-Alice.txt", "run_nodes7_name-Foo.txt", "run_nodes7.8_name-Bar.txt"],
+                               "run-2": ["run_nodes4_name-Bob.txt", "data.csv"]}}
+    with MockDir(file_structure2):
+        # all patterns are walked from the common base "tmp"
+        plans = _plan_walks([FormatPattern.compile(pattern) for pattern in patterns])
+        assert [(base, indices) for base, indices, _ in plans] == [("tmp", [0, 1, 2, 3])]
+
+        results = list(format_glob_multi(patterns))
+        expected = [(file, data, FormatPattern.compile(pattern).pattern)
+                    for pattern in patterns for file, data in format_glob(pattern)]
+        assert sorted(results, key=str) == sorted(expected, key=str)
+
+        # every directory is listed only once
+        from format_glob import _walk_patterns
+        list(_walk_patterns("tmp", plans[0][2], list_dir=list_dir))
+        assert sorted(listed) == sorted(set(listed))
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+def imported_modules(code):
+    # run the code in a fresh interpreter and get the imported modules from the "python -X importtime" log
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=Path(__file__).parent.parent,
+                            capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative_time)
+    return modules
+
+
+def test_lazy_import():
+    # the package itself does not import any of the heavy dependencies
+    modules = imported_modules("import rgerum_utils")
+    for name in ["numpy", "pandas", "matplotlib"]:
+        assert name not in modules
+    # the import time is given in microseconds
+    assert modules["rgerum_utils"] < 100_000
+
+    # the names only import what their submodule needs
+    modules = imported_modules("from rgerum_utils import TimeIt")
+    for name in ["numpy", "pandas", "matplotlib"]:
+        assert name not in modules
+
+    modules = imported_modules("from rgerum_utils import cache")
+    assert "numpy" in modules
+    for name in ["pandas", "matplotlib"]:
+        assert name not in modules
+
+    modules = imported_modules("from rgerum_utils import format_glob")
+    assert "pandas" in modules
+    assert "matplotlib" not in modules
+
+
+def test_submodule_import():
+    # importing a submodule does not replace the function of the same name
+    code = "import rgerum_utils.format_glob; import rgerum_utils; assert callable(rgerum_utils.format_glob)"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent.parent, check=True)
+    code = "import rgerum_utils.cache; from rgerum_utils import cache; assert cache.__name__ == 'cache'"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent.parent, check=True)
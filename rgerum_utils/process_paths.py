@@ -1,76 +1,209 @@
+import fnmatch
 import glob
+import os
+import re
 import sys
 
 from pathlib import Path
 
-from format_glob import format_glob
+from format_glob import FormatPattern, _plan_walks, _walk_patterns
 
 
-def processPaths(name, filter=None, file_name=None):
-    results = []
-    meta_data = []
-    # if the function is called with a list or tuple, iterate over those and join the results
-    if isinstance(name, (tuple, list)):
-        for n in name:
-            r, m = processPaths(n, filter=filter, file_name=file_name)
-            results.extend(r)
-            meta_data.extend(m)
+def _print_not_found(name):
+    # get a list of all parent folders
+    name = Path(name).absolute()
+    hierarchy = []
+    while name.parent != name:
+        hierarchy.append(name)
+        name = name.parent
+    # iterate over the parent folders, starting from the lowest
+    for path in hierarchy[::-1]:
+        # check if the path exists (or is a glob pattern with matches)
+        if "*" in str(path):
+            exists = len(glob.glob(str(path)))
+        else:
+            exists = path.exists()
+        # if it does not exist, we have found our problem
+        if not exists:
+            target = f"No file/folder \"{path.name}\""
+            if "*" in str(path.name):
+                target = f"Pattern \"{path.name}\" not found"
+            source = f"in folder \"{path.parent}\""
+            if "*" in str(path.parent):
+                source = f"in any folder matching the pattern \"{path.parent}\""
+            print(f"WARNING: {target} {source}", file=sys.stderr)
+            break
+
+
+class _GlobPattern:
+    """ a glob pattern or a plain filename split like a FormatPattern, to walk it together with the format patterns
+
+    The matching follows glob: * and ? do not match names starting with a dot and ** does not enter hidden folders.
+    :parameter
+    pattern: the glob pattern or filename
+    directories_only: weather to only match directories, which are returned with a trailing separator
+    """
+    def __init__(self, pattern, directories_only=False):
+        self.pattern = str(Path(pattern))
+        self.directories_only = directories_only
+        parts = self.pattern.split(os.sep)
+        # the leading parts without wildcards form the base directory
+        base_count = 0
+        while base_count < len(parts) - 1 and not glob.has_magic(parts[base_count]):
+            base_count += 1
+        self.base = os.sep.join(parts[:base_count])
+        if self.base == "" and base_count > 0:
+            self.base = os.sep
+        self.segments = []
+        for part in parts[base_count:]:
+            if part == "**":
+                self.segments.append(("**", None))
+            elif glob.has_magic(part):
+                regexp = fnmatch.translate(part)
+                if not part.startswith("."):
+                    regexp = r"(?!\.)" + regexp
+                self.segments.append(("match", re.compile(regexp)))
+            else:
+                self.segments.append(("literal", part))
+        self._recursive = ("**", None) in self.segments
+
+    @staticmethod
+    def walks(name):
+        """ the patterns to walk for a glob pattern, a trailing separator only matches directories and a trailing **
+        also matches the directory it starts from, like glob with recursive=True """
+        directories_only = str(name).endswith((os.sep, "/"))
+        path = Path(name)
+        if path.name != "**":
+            return [_GlobPattern(path, directories_only)]
+        walks = []
+        if str(path.parent) != ".":
+            walks.append(_GlobPattern(path.parent, directories_only=True))
+        # a trailing ** matches all files and folders below, with a separator only the folders
+        walks.append(_GlobPattern(path if directories_only else path / "*", directories_only))
+        return walks
+
+    def match(self, path):
+        """ the path like glob returns it, or None if glob would not return it """
+        if self.directories_only:
+            if not os.path.isdir(path):
+                return None
+            path = path if path.endswith(os.sep) else path + os.sep
+        if self._recursive and self._hidden(path):
+            return None
+        return path
+
+    def _hidden(self, path):
+        # weather a folder below the base was only reached by entering a hidden folder with **
+        for name in Path(os.path.relpath(path, self.base or ".")).parts:
+            # hidden names are only allowed where a part of the pattern explicitly starts with a dot
+            if name.startswith(".") and not any(name == matcher if kind == "literal" else matcher.fullmatch(name)
+                                                for kind, matcher in self.segments if kind != "**"):
+                return True
+        return False
+
+
+def _find_paths(names):
+    # iterate over the files of the patterns, yielding the file, its meta data and the index of the pattern
+    # all patterns share one walk per base directory, a file matching several patterns comes first with the first one
+    walks = []
+    for index, name in enumerate(names):
+        if "{" in str(name):
+            walks.append((FormatPattern.compile(name), index))
+        else:
+            walks.extend((pattern, index) for pattern in _GlobPattern.walks(name))
+    for base, indices, segment_lists in _plan_walks([pattern for pattern, _ in walks]):
+        for file, i in _walk_patterns(base, segment_lists):
+            pattern, index = walks[indices[i]]
+            if isinstance(pattern, _GlobPattern):
+                file = pattern.match(file)
+                if file is not None:
+                    yield file, {}, index
+                continue
+            meta = pattern.match(file)
+            if meta is not None:
+                yield file, meta, index
+
+
+def _meta_columns(names):
+    # the placeholder columns of all format_glob patterns, in the order of their first appearance
+    columns = {}
+    for name in names:
+        if "{" in str(name):
+            for col, column, converter in FormatPattern.compile(name).converters:
+                columns[column] = None
+    return list(columns)
+
+
+def _query_batch(batch, query, columns):
+    # evaluate the query over the meta data of a batch of (file, meta data, pattern index) at once, returns the matches
+    import numpy as np
+    import pandas as pd
+    # every batch has the columns of all patterns, the values of the files that do not have them are NaN
+    data = pd.DataFrame.from_records([item[1] for item in batch], index=range(len(batch))).reindex(columns=columns)
+    # the filename is a column for every kind of pattern
+    data["filename"] = [item[0] for item in batch]
+    if isinstance(query, str):
+        mask = data.eval(query)
     else:
+        mask = query(data)
+    return [batch[i] for i in np.flatnonzero(np.asarray(mask, dtype=bool))]
+
+
+def processPaths(name, filter=None, file_name=None, query=None, batch_size=10_000, return_pattern=False):
+    """ iterate over the files matching a path, a glob pattern or a format_glob pattern, or a list of them, and yield
+    each file with its meta data (the values of the {name} placeholders) as they are found
+
+    The patterns of a list are walked together, every directory below their common base directories is only listed
+    once and the files are yielded in the order of the walk. A file that matches several patterns of a list is only
+    returned once, for the first of these patterns.
+    :parameter
+    name: a filename or pattern, or a list or tuple of them
+    filter: a function that gets the filename and returns weather to keep the file
+    file_name: a filename pattern to search for in all subfolders of name, if name does not already end with it
+    query: a pandas query string over the meta data columns, e.g. "n > 3 and name != 'Bob'", or a function that gets a
+           DataFrame of the meta data and returns a boolean mask of the files to keep. It is evaluated in batches of
+           batch_size files, the DataFrame has a column for every placeholder of the patterns and the filename, the
+           values of the files that do not have a placeholder are NaN.
+    return_pattern: weather to yield (file, meta data, pattern) with the pattern that matched the file
+    """
+    names = list(name) if isinstance(name, (tuple, list)) else [name]
+    for i, name in enumerate(names):
         # add the file_name pattern if there is one and if it is not already there
         if file_name is not None and Path(name).suffix != Path(file_name).suffix:
-            name = Path(name) / "**" / file_name
-        # if it is a glob pattern, add all matching elements
-        if "{" in str(name):
-            for file, data in format_glob(name):
-                results.append(file)
-                meta_data.append(data)
-        elif "*" in str(name):
-            results = glob.glob(str(name), recursive=True)
-            meta_data = [{}]*len(results)
-        # or add the name directly
-        elif Path(name).exists():
-            results = [name]
-            meta_data = [{}]
+            names[i] = Path(name) / "**" / file_name
+    found = [0] * len(names)
+    seen = set()
+    columns = _meta_columns(names) if query is not None else None
 
+    def output(batch):
+        for file, meta, index in batch:
+            found[index] += 1
+            yield (file, meta, str(names[index])) if return_pattern else (file, meta)
+
+    batch = []
+    for file, meta, index in _find_paths(names):
+        # skip files that an earlier pattern already returned
+        key = os.path.normpath(os.path.abspath(file))
+        if key in seen:
+            continue
+        seen.add(key)
         # filter results if a filter is provided
-        if filter is not None:
-            meta_data2 = []
-            results2 = []
-            for n, m in zip(results, meta_data):
-                print("filter", n, filter(n))
-                if filter(n):
-                    meta_data2.append(m)
-                    results2.append(n)
-            results = results2
-            meta_data = meta_data2
-
-        # if nothing was found, try to give a meaningful error message
-        if len(results) == 0:
-            # get a list of all parent folders
-            name = Path(name).absolute()
-            hierarchy = []
-            while name.parent != name:
-                hierarchy.append(name)
-                name = name.parent
-            # iterate over the parent folders, starting from the lowest
-            for path in hierarchy[::-1]:
-                # check if the path exists (or is a glob pattern with matches)
-                if "*" in str(path):
-                    exists = len(glob.glob(str(path)))
-                else:
-                    exists = path.exists()
-                # if it does not exist, we have found our problem
-                if not exists:
-                    target = f"No file/folder \"{path.name}\""
-                    if "*" in str(path.name):
-                        target = f"Pattern \"{path.name}\" not found"
-                    source = f"in folder \"{path.parent}\""
-                    if "*" in str(path.parent):
-                        source = f"in any folder matching the pattern \"{path.parent}\""
-                    print(f"WARNING: {target} {source}", file=sys.stderr)
-                    break
-
-    return zip(results, meta_data)
+        if filter is not None and not filter(file):
+            continue
+        if query is None:
+            yield from output([(file, meta, index)])
+            continue
+        batch.append((file, meta, index))
+        if len(batch) >= batch_size:
+            yield from output(_query_batch(batch, query, columns))
+            batch = []
+    if batch:
+        yield from output(_query_batch(batch, query, columns))
+
+    # if nothing was found, try to give a meaningful error message
+    for name, count in zip(names, found):
+        if count == 0:
+            _print_not_found(name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+from process_paths import processPaths
+from mock_dir import MockDir
+import types
+
+# to test we create an artificial folder structure
+file_structure = {
+    "tmp": {
+        "run-1": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Bob.txt", "run_nodes7_name-Foo.txt"],
+        "run-2": ["run_nodes3_name-Alice.txt", "run_nodes4_name-Bob.txt", "other.csv"],
+    }
+}
+
+
+def test_process_paths():
+    with MockDir(file_structure):
+        results = processPaths("tmp/run-{run:d}/run_nodes{n:d}_name-{name}.txt")
+        # the results are produced as they are found
+        assert isinstance(results, types.GeneratorType)
+        results = sorted(results)
+        assert len(results) == 5
+        file, meta = results[0]
+        assert file == "tmp/run-1/run_nodes3_name-Alice.txt"
+        assert (meta["run"], meta["n"], meta["name"]) == (1, 3, "Alice")
+
+        # glob patterns and plain filenames
+        assert sorted(file for file, _ in processPaths("tmp/*/*.csv")) == ["tmp/run-2/other.csv"]
+        assert list(processPaths("tmp/run-2/other.csv")) == [("tmp/run-2/other.csv", {})]
+
+        # a file name that is searched in all subfolders
+        assert len(list(processPaths("tmp", file_name="*.txt"))) == 5
+
+
+def test_process_paths_duplicates():
+    with MockDir(file_structure):
+        # overlapping patterns return every file only once
+        results = list(processPaths(["tmp/run-1/run_nodes{n:d}_name-{name}.txt", "tmp/run-1/*.txt",
+                                     "tmp/run-1/run_nodes3_name-Alice.txt", "./tmp/run-1/run_nodes3_name-Alice.txt"]))
+        assert len(results) == 3
+        assert all("n" in meta for _, meta in results)
+
+
+def test_process_paths_filter():
+    pattern = "tmp/run-{run:d}/run_nodes{n:d}_name-{name}.txt"
+    with MockDir(file_structure):
+        results = list(processPaths(pattern, filter=lambda file: "run-1" in file))
+        assert len(results) == 3
+
+        # a query over the meta data, evaluated for a batch of files at once
+        results = list(processPaths(pattern, query="n > 3 and name != 'Bob'"))
+        assert [file for file, _ in results] == ["tmp/run-1/run_nodes7_name-Foo.txt"]
+        results = list(processPaths(pattern, query=lambda data: data.run == 2, batch_size=2))
+        assert sorted(meta["n"] for _, meta in results) == [3, 4]
+
+        # glob patterns and format patterns with different placeholders give the same result for every batch size
+        patterns = [pattern, "tmp/*/*.csv"]
+        for batch_size in [1, 2, 10_000]:
+            results = list(processPaths(patterns, query="run == 1", batch_size=batch_size))
+            assert len(results) == 3
+            results = list(processPaths(patterns, query="run != run", batch_size=batch_size))
+            assert [file for file, _ in results] == ["tmp/run-2/other.csv"]
+
+        # a query on the filename also works with only glob patterns and filenames
+        for patterns in ["tmp/*/*.csv", ["tmp/run-1/run_nodes3_name-Alice.txt", "tmp/*/*.csv"]]:
+            results = list(processPaths(patterns, query="filename.str.endswith('.csv')", batch_size=1))
+            assert [file for file, _ in results] == ["tmp/run-2/other.csv"]
+        assert len(list(processPaths("tmp/*/*.txt", query=lambda data: data.filename == data.filename))) == 5
+
+
+def test_process_paths_patterns():
+    with MockDir(file_structure):
+        patterns = ["tmp/run-1/run_nodes{n:d}_name-{name}.txt", "tmp/run-{run:d}/run_nodes3_name-{name}.txt",
+                    "tmp/*/*.csv"]
+        results = list(processPaths(patterns, return_pattern=True))
+        assert len(results) == 5
+        # every file is tagged with the first pattern that matched it
+        tags = {file: pattern for file, _, pattern in results}
+        assert tags["tmp/run-1/run_nodes3_name-Alice.txt"] == patterns[0]
+        assert tags["tmp/run-2/run_nodes3_name-Alice.txt"] == patterns[1]
+        assert tags["tmp/run-2/other.csv"] == patterns[2]
+
+        # also when a glob pattern comes before a format pattern
+        patterns = ["tmp/*/*.txt", "tmp/run-{run:d}/run_nodes{n:d}_name-{name}.txt", "tmp/run-?/other.csv"]
+        results = list(processPaths(patterns, return_pattern=True))
+        assert len(results) == 6
+        assert [pattern for _, _, pattern in results].count(patterns[0]) == 5
+        assert all(meta == {} for _, meta, _ in results)
+        assert ("tmp/run-2/other.csv", {}, patterns[2]) in results
+
+
+def test_process_paths_hidden():
+    from pathlib import Path
+    with MockDir(file_structure):
+        Path("tmp/run-1/.hidden.txt").touch()
+        Path("tmp/.hidden").mkdir()
+        Path("tmp/.hidden/run_nodes5_name-Eve.txt").touch()
+        # like glob, wildcards do not match hidden files and folders
+        assert len(list(processPaths("tmp/*/*.txt"))) == 5
+        assert len(list(processPaths("tmp/**/*.txt"))) == 5
+        assert len(list(processPaths("tmp/**"))) == 9
+        assert len(list(processPaths("tmp/run-1/.*.txt"))) == 1
+        assert len(list(processPaths("tmp/.hidden/*.txt"))) == 1
+        assert len(list(processPaths("tmp/.hidden/**/*.txt"))) == 1
+
+        # a trailing separator only matches folders and a trailing ** also the folder it starts from
+        import glob
+        Path("tmp/run-1/sub").mkdir()
+        assert sorted(file for file, _ in processPaths("tmp/*/")) == ["tmp/run-1/", "tmp/run-2/"]
+        assert sorted(file for file, _ in processPaths("tmp/**/")) == ["tmp/", "tmp/run-1/", "tmp/run-1/sub/",
+                                                                      "tmp/run-2/"]
+        assert "tmp/" in [file for file, _ in processPaths("tmp/**")]
+        for pattern in ["tmp/*/", "tmp/**/", "tmp/**", "tmp/*/**", "tmp/run-1/", "tmp/run-2/other.csv/"]:
+            assert sorted(file for file, _ in processPaths(pattern)) == sorted(glob.glob(pattern, recursive=True))
@@ -1,18 +1,344 @@
+import functools
+import json
+import os
+import sys
+import threading
 import time
+from array import array
+
+# the profiler that collects the TimeIt blocks, set with "with Profiler():"
+_active_profiler = None
+
+
+def _rss():
+    # the current resident set size of the process in bytes, or None if it cannot be determined
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class _Node:
+    # the aggregated timings of one block at one place in the tree of nested blocks, in nanoseconds
+    __slots__ = ("name", "parent", "children", "count", "total", "min", "max", "samples", "depth", "peak_total",
+                 "peak_max", "rss_total", "rss_max", "blocks_total", "blocks_max")
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.samples = array("q")
+        self.depth = 0 if parent is None else parent.depth + 1
+        # the memory stats in bytes and blocks, only with Profiler(memory=True)
+        self.peak_total = 0
+        self.peak_max = None
+        self.rss_total = 0
+        self.rss_max = None
+        self.blocks_total = 0
+        self.blocks_max = None
+
+    @property
+    def path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return "/".join(names[::-1])
+
+
+class Profiler:
+    """ collect the TimeIt blocks that run while the profiler is active into a tree of nested blocks
+
+    Repeated blocks are aggregated to their count, total, mean, min, max and percentiles instead of being printed.
+    Blocks in other threads start their own branches from the root of the tree.
+    :parameter
+    samples: weather to keep the duration of every call, needed for the percentiles (8 bytes per call)
+    trace: weather to keep the start time of every call, needed for a timeline in to_chrome_trace and to_speedscope,
+           otherwise they show the aggregated tree like a flame graph
+    memory: weather to also record for every block the peak memory allocated by python above the memory at its start
+            (with tracemalloc), the change of the resident set size of the process and the change of the number of
+            allocated memory blocks. Tracing the allocations slows down the program noticeably. The peak memory of
+            blocks that run at the same time in different threads is not separated.
+    """
+    def __init__(self, samples=True, trace=False, memory=False):
+        self.keep_samples = samples
+        self.trace = trace
+        self.memory = memory
+        self._started_tracemalloc = False
+        self.root = _Node("", None)
+        self.events = []
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._previous = []
+        self.start_ns = time.perf_counter_ns()
+
+    def start(self):
+        """ make this the active profiler """
+        global _active_profiler
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+        self._previous.append(_active_profiler)
+        _active_profiler = self
+        return self
+
+    def stop(self):
+        """ restore the profiler that was active before """
+        global _active_profiler
+        _active_profiler = self._previous.pop()
+        if self._started_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _push(self, name):
+        # enter a block, returns the node, the start time and the memory at the start to pass to _pop
+        local = self._local
+        parent = getattr(local, "node", None) or self.root
+        node = parent.children.get(name)
+        if node is None:
+            with self.lock:
+                node = parent.children.setdefault(name, _Node(name, parent))
+        local.node = node
+        # the memory is measured before the time, so that the measurement is not part of the duration
+        memory_frame = self._push_memory(local) if self.memory else None
+        return node, time.perf_counter_ns(), memory_frame
+
+    def _push_memory(self, local):
+        import tracemalloc
+        frames = getattr(local, "memory_frames", None)
+        if frames is None:
+            frames = local.memory_frames = []
+        current, peak = tracemalloc.get_traced_memory()
+        # keep the peak of the enclosing block before the peak is reset for this block
+        if frames:
+            frames[-1][1] = max(frames[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current, _rss(), sys.getallocatedblocks()]
+        frames.append(frame)
+        return frame
+
+    def _pop_memory(self, node, frame):
+        import tracemalloc
+        frames = self._local.memory_frames
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(frame[1], peak)
+        frames.pop()
+        if frames:
+            frames[-1][1] = max(frames[-1][1], peak)
+        peak -= frame[0]
+        rss = _rss()
+        rss = rss - frame[2] if rss is not None and frame[2] is not None else 0
+        blocks = sys.getallocatedblocks() - frame[3]
+        node.peak_total += peak
+        node.peak_max = peak if node.peak_max is None else max(node.peak_max, peak)
+        node.rss_total += rss
+        node.rss_max = rss if node.rss_max is None else max(node.rss_max, rss)
+        node.blocks_total += blocks
+        node.blocks_max = blocks if node.blocks_max is None else max(node.blocks_max, blocks)
+
+    def _pop(self, node, start, memory_frame):
+        duration = time.perf_counter_ns() - start
+        with self.lock:
+            node.count += 1
+            node.total += duration
+            if node.min is None or duration < node.min:
+                node.min = duration
+            if node.max is None or duration > node.max:
+                node.max = duration
+            if self.keep_samples:
+                node.samples.append(duration)
+            if self.trace:
+                self.events.append((node, threading.get_ident(), start, duration))
+            if memory_frame is not None:
+                self._pop_memory(node, memory_frame)
+        self._local.node = node.parent
+
+    def nodes(self):
+        """ iterate over the blocks depth first """
+        stack = list(reversed(self.root.children.values()))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children.values()))
+
+    def stats(self, percentiles=(50, 90, 99)):
+        """ a list with a dict for every block: its name, path, depth, count and the total, mean, min, max and
+        percentiles of its duration in seconds, and with memory=True the mean and max of the peak memory, the rss change
+        and the change of the allocated blocks """
+        rows = []
+        for node in self.nodes():
+            row = dict(name=node.name, path=node.path, depth=node.depth - 1, count=node.count, total=node.total * 1e-9,
+                       mean=node.total / node.count * 1e-9 if node.count else None,
+                       min=node.min * 1e-9 if node.min is not None else None,
+                       max=node.max * 1e-9 if node.max is not None else None)
+            if percentiles:
+                values = [None] * len(percentiles)
+                if len(node.samples):
+                    import numpy as np
+                    values = np.percentile(np.frombuffer(node.samples, dtype=np.int64), percentiles) * 1e-9
+                for p, value in zip(percentiles, values):
+                    row[f"p{p}"] = value
+            if self.memory:
+                count = node.count or 1
+                row.update(peak_memory=node.peak_total / count, max_peak_memory=node.peak_max,
+                           rss_delta=node.rss_total / count, max_rss_delta=node.rss_max,
+                           allocated_blocks=node.blocks_total / count, max_allocated_blocks=node.blocks_max)
+            rows.append(row)
+        return rows
+
+    def table(self, percentiles=(50, 90, 99)):
+        """ the stats as a text table, with the nested blocks indented """
+        def format_time(seconds):
+            if seconds is None:
+                return "-"
+            for unit, factor in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+                if seconds >= factor:
+                    return f"{seconds / factor:.3g}{unit}"
+            return f"{seconds / 1e-9:.3g}ns"
+
+        def format_size(size):
+            if size is None:
+                return "-"
+            for unit in ["B", "KB", "MB", "GB"]:
+                if abs(size) < 1024:
+                    return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+                size /= 1024
+            return f"{size:.1f}TB"
+
+        rows = self.stats(percentiles)
+        columns = [(column, format_time) for column in ["total", "mean", "min", "max"] + [f"p{p}" for p in percentiles]]
+        if self.memory:
+            columns += [("peak_memory", format_size), ("max_peak_memory", format_size), ("rss_delta", format_size),
+                        ("allocated_blocks", lambda blocks: f"{blocks:.0f}")]
+        headers = {"max_peak_memory": "max_peak", "peak_memory": "peak", "rss_delta": "rss", "allocated_blocks": "blocks"}
+        width = max([len("block")] + [2 * row["depth"] + len(row["name"]) for row in rows])
+        lines = [f"{'block':{width}} {'count':>8} " + " ".join(f"{headers.get(column, column):>8}"
+                                                            for column, _ in columns)]
+        for row in rows:
+            name = "  " * row["depth"] + row["name"]
+            lines.append(f"{name:{width}} {row['count']:>8} " +
+                         " ".join(f"{format_value(row[column]):>8}" for column, format_value in columns))
+        return "\n".join(lines)
+
+    def print(self, percentiles=(50, 90, 99)):
+        print(self.table(percentiles))
+
+    def to_dataframe(self, percentiles=(50, 90, 99)):
+        """ the stats as a pandas DataFrame """
+        import pandas as pd
+        return pd.DataFrame(self.stats(percentiles))
+
+    def _timeline(self):
+        # the calls as (node, thread, start, duration) in ns relative to the start of the profiler, either the traced
+        # calls or the aggregated tree laid out like a flame graph
+        if self.trace:
+            return [(node, thread, start - self.start_ns, duration) for node, thread, start, duration in self.events]
+        calls = []
+
+        def layout(node, start):
+            calls.append((node, 0, start, node.total))
+            for child in node.children.values():
+                layout(child, start)
+                start += child.total
+
+        start = 0
+        for node in self.root.children.values():
+            layout(node, start)
+            start += node.total
+        return calls
+
+    def to_chrome_trace(self, filename=None):
+        """ the calls in the Chrome trace event format (chrome://tracing, ui.perfetto.dev), written to filename if given """
+        events = [dict(name=node.name, cat=node.path, ph="X", ts=start / 1e3, dur=duration / 1e3, pid=os.getpid(),
+                       tid=thread) for node, thread, start, duration in self._timeline()]
+        trace = dict(traceEvents=events, displayTimeUnit="ms")
+        if filename is not None:
+            with open(filename, "w") as fp:
+                json.dump(trace, fp)
+        return trace
+
+    def to_speedscope(self, filename=None, name="TimeIt"):
+        """ the calls in the speedscope file format (speedscope.app), written to filename if given """
+        frames = {}
+        threads = {}
+        for node, thread, start, duration in self._timeline():
+            frame = frames.setdefault(node, len(frames))
+            # closing events come before opening events at the same time, the inner blocks close first
+            threads.setdefault(thread, []).extend([(start, 1, node.depth, "O", frame),
+                                                   (start + duration, 0, -node.depth, "C", frame)])
+        profiles = []
+        for thread, events in threads.items():
+            events.sort()
+            profiles.append(dict(type="evented", name=f"{name} thread {thread}", unit="nanoseconds",
+                                 startValue=events[0][0], endValue=events[-1][0],
+                                 events=[dict(type=kind, frame=frame, at=at) for at, _, _, kind, frame in events]))
+        speedscope = {"$schema": "https://www.speedscope.app/file-format-schema.json",
+                      "shared": dict(frames=[dict(name=node.name, file=node.path) for node in frames]),
+                      "profiles": profiles, "name": name, "exporter": "rgerum_utils.timeit"}
+        if filename is not None:
+            with open(filename, "w") as fp:
+                json.dump(speedscope, fp)
+        return speedscope
 
 
 class TimeIt:
-    def __init__(self, name):
+    """ time a block of code, used as "with TimeIt(name):" or as a decorator "@TimeIt()"
+
+    Without an active Profiler the time is printed, within "with Profiler():" the block is added to the profiler.
+    :parameter
+    name: the name of the block, for a decorator defaults to the name of the function
+    profiler: the profiler to add the block to instead of the active one
+    """
+    def __init__(self, name=None, profiler=None):
         self.name = name
+        self.profiler = profiler
 
     def __enter__(self):
-        self.start_time = time.time()
+        self._profiler = self.profiler or _active_profiler
+        if self._profiler is not None:
+            self._token = self._profiler._push(self.name)
+        else:
+            self.start_time = time.perf_counter()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        print(f"TimeIt \"{self.name}\": {time.time()-self.start_time:.3}s")
+        if self._profiler is not None:
+            self._profiler._pop(*self._token)
+        else:
+            print(f"TimeIt \"{self.name}\": {time.perf_counter()-self.start_time:.3}s")
+
+    def __call__(self, func):
+        name = self.name or func.__qualname__
+        profiler = self.profiler
+
+        @functools.wraps(func)
+        def wrapped_func(*args, **kwargs):
+            with TimeIt(name, profiler):
+                return func(*args, **kwargs)
+        return wrapped_func
 
 
 if __name__ == "__main__":
     with TimeIt("sleep"):
         for i in range(14):
-            time.sleep(0.1)
\ No newline at end of file
+            time.sleep(0.1)
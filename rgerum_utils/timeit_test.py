@@ -0,0 +1,106 @@
+import json
+import threading
+
+from timeit import TimeIt, Profiler
+
+
+def test_print(capsys):
+    with TimeIt("block"):
+        pass
+    assert capsys.readouterr().out.startswith("TimeIt \"block\": ")
+
+
+def test_profiler(capsys):
+    @TimeIt()
+    def load(i):
+        with TimeIt("read"):
+            pass
+        if i % 2:
+            with TimeIt("parse"):
+                pass
+
+    with Profiler() as profiler:
+        with TimeIt("main"):
+            for i in range(100):
+                load(i)
+        thread = threading.Thread(target=load, args=(1,))
+        thread.start()
+        thread.join()
+    # nothing is printed within the profiler
+    assert capsys.readouterr().out == ""
+
+    stats = {row["path"]: row for row in profiler.stats()}
+    assert list(stats) == ["main", "main/test_profiler.<locals>.load", "main/test_profiler.<locals>.load/read",
+                           "main/test_profiler.<locals>.load/parse", "test_profiler.<locals>.load",
+                           "test_profiler.<locals>.load/read", "test_profiler.<locals>.load/parse"]
+    assert stats["main/test_profiler.<locals>.load/read"]["count"] == 100
+    assert stats["main/test_profiler.<locals>.load/parse"]["count"] == 50
+    row = stats["main/test_profiler.<locals>.load"]
+    assert row["depth"] == 1
+    assert row["min"] <= row["p50"] <= row["p90"] <= row["max"] <= row["total"] <= stats["main"]["total"]
+    assert abs(row["mean"] * row["count"] - row["total"]) < 1e-9
+
+    table = profiler.table().splitlines()
+    assert table[0].split() == ["block", "count", "total", "mean", "min", "max", "p50", "p90", "p99"]
+    assert table[3].startswith("    read") and table[3].split()[1] == "100"
+    assert len(profiler.to_dataframe()) == 7
+
+    # a flame graph of the aggregated tree
+    trace = profiler.to_chrome_trace()
+    assert len(trace["traceEvents"]) == 7
+    speedscope = profiler.to_speedscope()
+    assert len(speedscope["shared"]["frames"]) == 7
+    assert len(speedscope["profiles"][0]["events"]) == 14
+
+
+def test_trace(tmp_path):
+    with Profiler(trace=True) as profiler:
+        for i in range(3):
+            with TimeIt("outer"):
+                with TimeIt("inner"):
+                    pass
+    trace = profiler.to_chrome_trace(tmp_path / "trace.json")
+    assert json.loads((tmp_path / "trace.json").read_text()) == trace
+    assert [event["name"] for event in trace["traceEvents"]] == ["inner", "outer"] * 3
+
+    events = profiler.to_speedscope(tmp_path / "profile.json")["profiles"][0]["events"]
+    frames = [frame["name"] for frame in json.loads((tmp_path / "profile.json").read_text())["shared"]["frames"]]
+    # the events are properly nested
+    stack = []
+    for event in events:
+        if event["type"] == "O":
+            stack.append(event["frame"])
+        else:
+            assert stack.pop() == event["frame"]
+    assert stack == [] and len(events) == 12
+    assert [frames[event["frame"]] for event in events[:4]] == ["outer", "inner", "inner", "outer"]
+
+
+def test_memory():
+    import tracemalloc
+
+    with Profiler(memory=True) as profiler:
+        for i in range(3):
+            with TimeIt("outer"):
+                data = [bytearray(1_000_000)]
+                with TimeIt("inner"):
+                    data.append(bytearray(5_000_000))
+                del data
+                # a block that keeps its allocation
+                with TimeIt("keep"):
+                    kept = [object() for _ in range(1000)]
+    assert not tracemalloc.is_tracing()
+
+    stats = {row["path"]: row for row in profiler.stats()}
+    assert 5_000_000 <= stats["outer/inner"]["peak_memory"] < 5_100_000
+    # the peak of the outer block includes the peak of the inner block
+    assert 6_000_000 <= stats["outer"]["max_peak_memory"] < 6_200_000
+    assert stats["outer/keep"]["max_allocated_blocks"] >= 1000
+    assert "rss_delta" in stats["outer"]
+    assert profiler.table().splitlines()[0].split()[-4:] == ["peak", "max_peak", "rss", "blocks"]
+
+    # without memory=True nothing is traced
+    with Profiler() as profiler:
+        with TimeIt("block"):
+            assert not tracemalloc.is_tracing()
+    assert "peak_memory" not in profiler.stats()[0]